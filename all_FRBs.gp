@@ -0,0 +1,4 @@
+# Written by frb_overtime.py from all_FRBs
+num_frbs = 108
+max_per_year = 44
+frb_plot = "plot \"all_FRBs\" using 2:xtic(1) title 'Parkes', '' u 3 title 'UTMOST', '' u 4 title 'GBT', '' u 5 title 'Arecibo', '' u 6 title 'ASKAP', '' u 7 title 'CHIME' lt 8, '' u 8 title 'DSA-10' lt 7, '' u 9 title 'WSRT' lt rgb '#7FFFD4'"
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+# Name: Overview plotter benchmark
+#
+# Description: Times the stages of superb_overview_plotter.py (load, classify,
+# histogram, each render panel) separately on synthetic candidate files of
+# increasing size, using its StageTimer to record wall/CPU time and peak
+# RSS for each. Every size runs in a fresh process so the memory figures
+# don't carry over. Results are written as JSON; -baseline compares them
+# against an earlier run and exits non-zero if any stage got slower than
+# -tolerance times the old figure.
+
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+
+def run_stages(filename, nbeams, backend, compact=False):
+    # Runs in the child process; returns the per-stage timing report
+    import superb_overview_plotter as sop
+    from heimdall_cands import CandidateLoader, make_cand_dtype, \
+        make_compact_dtype
+    args = sop.make_parser().parse_args(['-f', filename,
+                                         '-nbeams', str(nbeams),
+                                         '-backend', backend, '-g', 'png'] +
+                                        ['-compact'] * compact)
+    timer = sop.StageTimer()
+    stage = timer.stage
+    loader = CandidateLoader()
+    if compact:
+        loader.dtype = make_compact_dtype(sop.overview_fields, nbeams)
+        loader.zero_based = True
+    else:
+        loader.dtype = make_cand_dtype(nbeams)
+    for sidecar in loader.sidecar_names(filename):
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+    stage('load', loader.load, filename)
+    cands = stage('load_cached', loader.load, filename)
+    if not compact:
+        cands = stage('adjust', sop.adjust_indices, cands)
+    classifier = sop.configure_classifier(args)
+    codes = stage('classify', classifier.classify, cands)
+    categories = stage('select', sop.select_categories, classifier, cands,
+                       codes)
+    dm_hists, snr_hists = stage('histograms', sop.build_histograms, cands,
+                                nbeams)
+    timer.count(len(cands))
+    renderer = sop.make_renderer(args, timer)
+    renderer.render(categories, dm_hists, snr_hists)
+    report = timer.report()
+    report['ncands'] = len(cands)
+    return report
+
+def data_file(datadir, n, nbeams):
+    from fake_heimdall_cands import FakeCandidates
+    filename = os.path.join(datadir, 'fake_%i_%ibeams.cand' % (n, nbeams))
+    if not os.path.exists(filename):
+        print "Generating %s" % filename
+        FakeCandidates(nbeams, seed=n).write(filename, n)
+    return filename
+
+def run_size(filename, nbeams, backend, datadir, compact=False):
+    cmd = [sys.executable, os.path.abspath(__file__), '-child', filename,
+           '-nbeams', str(nbeams), '-backend', backend] + \
+          ['-compact'] * compact
+    # Run where the plots (overview.png) can be thrown away
+    out = subprocess.check_output(cmd, cwd=datadir)
+    return json.loads(out.splitlines()[-1])
+
+def compare(results, baseline, tolerance):
+    old = dict(((r['ncands'], s['stage']), s['wall_s'])
+               for r in baseline['results'] for s in r['stages'])
+    slower = []
+    for r in results['results']:
+        for s in r['stages']:
+            key = (r['ncands'], s['stage'])
+            # Ignore stages too quick to time reliably
+            if key in old and old[key] > 0.01 and \
+               s['wall_s'] > tolerance * old[key]:
+                slower.append((key, old[key], s['wall_s']))
+    for (n, name), before, after in slower:
+        print "Regression: %s at %i candidates %.3g s -> %.3g s" \
+            % (name, n, before, after)
+    return slower
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks the Heimdall overview plotter.")
+    parser.add_argument('-sizes', type=float, nargs='+',
+                        default=[1e3, 1e4, 1e5, 1e6])
+    parser.add_argument('-nbeams', type=int, default=13)
+    parser.add_argument('-backend', choices=("gnuplot", "agg"), default="agg")
+    parser.add_argument('-dir', default="bench_data",
+                        help="where synthetic candidate files are kept")
+    parser.add_argument('-o', default="bench_results.json")
+    parser.add_argument('-baseline', help="earlier results to compare to")
+    parser.add_argument('-tolerance', type=float, default=1.5)
+    parser.add_argument('-compact', action="store_true",
+                        help="benchmark the compact column load")
+    parser.add_argument('-child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print json.dumps(run_stages(args.child, args.nbeams, args.backend,
+                                    args.compact))
+        sys.exit(0)
+
+    import numpy as np
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+    results = {'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'nbeams': args.nbeams,
+               'backend': args.backend,
+               'compact': args.compact,
+               'results': []}
+    for n in args.sizes:
+        filename = data_file(args.dir, int(n), args.nbeams)
+        result = run_size(os.path.abspath(filename), args.nbeams,
+                          args.backend, args.dir, args.compact)
+        results['results'].append(result)
+        print "%10i candidates:" % result['ncands'],
+        print ", ".join(["%s %.3g s" % (s['stage'], s['wall_s'])
+                         for s in result['stages']]),
+        print "(peak %.0f MB)" % result['peak_rss_mb']
+    with open(args.o, 'w') as f:
+        json.dump(results, f, indent=1)
+    print "Wrote %s" % args.o
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+# Name: FRB sky coordinate check
+#
+# Description: Compares frb_sky's vectorised J2000 equatorial -> Galactic
+# rotation with ephem.Galactic on a few known positions (the Galactic centre
+# and pole, some catalogue FRBs) and on random ones. Exits non-zero if any
+# position differs by more than -tolerance arcseconds; skips if ephem is not
+# installed.
+
+import sys
+import argparse
+import numpy as np
+import frb_sky
+
+# RAJ, DECJ strings as in the catalogue
+known = [('17:45:40.04', '-29:00:28.1'),    # Galactic centre
+         ('12:51:26.28', '27:07:42.0'),     # north Galactic pole
+         ('05:31:58.70', '33:08:52.5'),     # FRB 121102
+         ('01:18:06', '-75:12:19'),         # FRB 010724
+         ('05:45:54.36', '28:56:10.2'),     # Galactic anticentre
+         ('00:00:00', '-90:00:00'),         # celestial pole
+         ('23:59:59.99', '00:00:00')]
+
+def ephem_galactic(ephem, raj, decj):
+    gl, gb = [], []
+    for r, d in zip(raj, decj):
+        gal = ephem.Galactic(ephem.Equatorial(r, d, epoch=ephem.J2000))
+        gl.append(float(gal.lon))
+        gb.append(float(gal.lat))
+    return np.array(gl), np.array(gb)
+
+def separation(lon1, lat1, lon2, lat2):
+    # Angle between directions [rad], well conditioned for small angles
+    return 2 * np.arcsin(np.sqrt(np.sin((lat2 - lat1) / 2)**2 +
+                                 np.cos(lat1) * np.cos(lat2) *
+                                 np.sin((lon2 - lon1) / 2)**2))
+
+def random_positions(n, seed):
+    rng = np.random.RandomState(seed)
+    ra = rng.uniform(0.0, 24.0, n)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, n)))
+    def sexagesimal(x):
+        sign = '-' if x < 0 else ''
+        x = abs(x)
+        return '%s%02d:%02d:%07.4f' % (sign, int(x), int(x * 60) % 60,
+                                       (x * 3600) % 60)
+    return [sexagesimal(x) for x in ra], [sexagesimal(x) for x in dec]
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks frb_sky's Galactic coordinates against ephem.")
+    parser.add_argument('-n', type=int, default=200,
+                        help="number of random positions")
+    parser.add_argument('-seed', type=int, default=1)
+    parser.add_argument('-tolerance', type=float, default=1.0,
+                        help="largest allowed difference [arcsec]")
+    args = parser.parse_args()
+    try:
+        import ephem
+    except ImportError:
+        print "ephem is not installed; skipping"
+        return 0
+
+    raj, decj = [list(c) for c in zip(*known)]
+    rand_raj, rand_decj = random_positions(args.n, args.seed)
+    raj += rand_raj
+    decj += rand_decj
+
+    gl, gb = frb_sky.galactic_coords(raj, decj)
+    ref_gl, ref_gb = ephem_galactic(ephem, raj, decj)
+    failed = 0
+    if np.any(np.abs(gl) > np.pi):
+        print "gl is not wrapped to [-pi, pi]"
+        failed += 1
+    diff = np.degrees(separation(gl, gb, ref_gl, ref_gb)) * 3600
+    for i in range(len(known)):
+        print "%12s %12s  gl %9.4f gb %8.4f  ephem %9.4f %8.4f  %.2e arcsec" \
+            % (raj[i], decj[i], np.degrees(gl[i]), np.degrees(gb[i]),
+               np.degrees(ref_gl[i]), np.degrees(ref_gb[i]), diff[i])
+    bad = np.flatnonzero(diff > args.tolerance)
+    for i in bad:
+        print "%s %s differs by %.3f arcsec" % (raj[i], decj[i], diff[i])
+    failed += len(bad)
+    print "%i positions, worst difference %.2e arcsec" % (len(diff),
+                                                         diff.max())
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
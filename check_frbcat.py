@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+# Name: FRB catalogue cache check
+#
+# Description: Serves a small catalogue CSV from a local HTTP server with an
+# ETag and checks frbcat's refresh against it: the first fetch writes the
+# CSV and its column store, an unchanged catalogue is answered with 304 and
+# leaves the store alone, and a changed one rebuilds the store. Exits
+# non-zero if any check fails.
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import BaseHTTPServer
+import numpy as np
+import frbcat
+
+header = "Name,RAJ,DECJ,UTC,Telescope\n"
+rows = ["FRB010125,19:06:53,-40:37:14,2001/01/25 00:29:15.790,parkes\n",
+        "FRB010621,18:52:05,-08:29:35,2001/06/21 13:02:10.795,parkes\n",
+        "FRB121102,05:31:58.70,33:08:52.5,2012/11/02 06:35:53.244,arecibo\n"]
+
+class CatalogueHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Serves server.body with an ETag, honouring If-None-Match
+    def do_GET(self):
+        body = self.server.body
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.getheader('If-None-Match') == etag:
+            self.server.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.statuses.append(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_server(body):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), CatalogueHandler)
+    server.body = body
+    server.statuses = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def store_state(catalogue):
+    st = os.stat(catalogue.store_name())
+    with np.load(catalogue.store_name()) as store:
+        return st.st_mtime, st.st_ino, str(store['sha1'])
+
+def main():
+    server = start_server(header + ''.join(rows[:2]))
+    url = 'http://127.0.0.1:%i/table.php' % server.server_address[1]
+    directory = tempfile.mkdtemp(prefix='check_frbcat')
+    failures = []
+    def check(ok, what):
+        print "%s: %s" % ("ok" if ok else "FAILED", what)
+        if not ok:
+            failures.append(what)
+    try:
+        filename = os.path.join(directory, 'frbcat.csv')
+        catalogue = frbcat.FRBCatalogue(filename, url)
+
+        cat = frbcat.load_catalogue(filename, url, update=True)
+        check(server.statuses == [200], "first fetch is a full download")
+        check(os.path.exists(catalogue.store_name()),
+              "first fetch writes the column store")
+        check(len(cat['name']) == 2, "store holds the served rows")
+        before = store_state(catalogue)
+
+        # Make a rewritten store visible in the mtime
+        time.sleep(1.1)
+        cat = frbcat.load_catalogue(filename, url, update=True)
+        check(server.statuses[-1] == 304, "unchanged ETag gives a 304")
+        check(store_state(catalogue) == before,
+              "a 304 leaves the column store alone")
+        check(len(cat['name']) == 2, "store still holds the served rows")
+
+        server.body = header + ''.join(rows)
+        cat = frbcat.load_catalogue(filename, url, update=True)
+        check(server.statuses[-1] == 200, "changed body is downloaded")
+        after = store_state(catalogue)
+        check(after[2] != before[2] and after[:2] != before[:2],
+              "changed body rebuilds the column store")
+        check(list(cat['name']) == ['FRB010125', 'FRB010621', 'FRB121102'],
+              "rebuilt store holds the new rows")
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+    if failures:
+        print "%i checks failed" % len(failures)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
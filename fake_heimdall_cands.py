@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+# Name: Fake Heimdall candidates
+#
+# Description: Writes synthetic Heimdall candidate files in the 14-column
+# format read by superb_overview_plotter.py, for testing and benchmarking
+# the overview plotter at any size. The candidates are a mix of noise
+# spikes, multi-beam (coincident) RFI, low-DM junk, wide-filter RFI and a
+# few bright dispersed pulses, with configurable fractions and beam count.
+# Files are generated and written in chunks so 10^8 rows fit in memory.
+
+import numpy as np
+from heimdall_cands import make_cand_dtype, popcount
+
+class FakeCandidates(object):
+    def __init__(self, nbeams=13, seed=None):
+        self.nbeams     = nbeams
+        self.tobs       = 600.0   # observation length [s]
+        self.tsamp      = 64e-6   # sampling time [s]
+        self.max_filter = 12
+        self.dm_max     = 2000.0
+        self.rfi_frac   = 0.05    # seen in many beams at once
+        self.lowdm_frac = 0.10    # DM below ~1.5
+        self.fat_frac   = 0.05    # widest boxcar filters
+        self.pulse_frac = 1e-4    # bright, well-detected dispersed pulses
+        self.secondary_frac = 0.2 # reported in a beam other than the primary
+        self.chunk      = 1000000
+        self.rng        = np.random.RandomState(seed)
+        self.dtype      = make_cand_dtype(nbeams)
+
+    def make(self, n, t0=0.0, t1=None):
+        # n candidates spread uniformly in time over [t0, t1)
+        rng = self.rng
+        if t1 is None:
+            t1 = self.tobs
+        cands = np.zeros(n, dtype=self.dtype)
+        time = np.sort(rng.uniform(t0, t1, n))
+        beam = rng.randint(0, self.nbeams, n)
+        cands['time']      = time
+        cands['samp_idx']  = (time / self.tsamp).astype(np.int64)
+        cands['snr']       = 6.0 + rng.exponential(1.5, n)
+        cands['filter']    = rng.randint(0, self.max_filter - 1, n)
+        cands['dm']        = 10**rng.uniform(0.2, np.log10(self.dm_max), n)
+        cands['members']   = 1 + rng.geometric(0.3, n)
+        cands['beam']      = beam + 1
+        cands['prim_beam'] = beam + 1
+        cands['nbeams']    = 1
+        masks = self.beam_masks(beam)
+
+        # Each candidate gets at most one kind of contamination
+        kind = rng.uniform(size=n)
+        edges = np.cumsum([self.rfi_frac, self.lowdm_frac, self.fat_frac,
+                           self.pulse_frac])
+        rfi   = kind < edges[0]
+        lowdm = (kind >= edges[0]) & (kind < edges[1])
+        fat   = (kind >= edges[1]) & (kind < edges[2])
+        pulse = (kind >= edges[2]) & (kind < edges[3])
+
+        # Coincident RFI: bright, seen in a random subset of the beams
+        nrfi = rfi.sum()
+        cands['snr'][rfi] = 6.0 + rng.exponential(5.0, nrfi)
+        cands['members'][rfi] = rng.randint(3, 200, nrfi)
+        extra = rng.randint(0, self.nbeams, (nrfi, max(1, self.nbeams // 2)))
+        for col in extra.T:
+            masks[rfi] |= self.beam_masks(col)
+        cands['dm'][lowdm] = rng.uniform(0.0, 1.5, lowdm.sum())
+        cands['members'][lowdm] = rng.randint(3, 50, lowdm.sum())
+        cands['filter'][fat] = rng.randint(self.max_filter,
+                                           self.max_filter + 3, fat.sum())
+        cands['members'][fat] = rng.randint(3, 50, fat.sum())
+        npulse = pulse.sum()
+        cands['snr'][pulse] = 10.0 + rng.exponential(10.0, npulse)
+        cands['members'][pulse] = rng.randint(20, 500, npulse)
+        cands['filter'][pulse] = rng.randint(0, 6, npulse)
+
+        # Secondary detections name another beam as the primary
+        secondary = rng.uniform(size=n) < self.secondary_frac
+        cands['prim_beam'][secondary] = \
+            (beam[secondary] + rng.randint(1, max(2, self.nbeams),
+                                           secondary.sum())) \
+            % self.nbeams + 1
+
+        self.set_masks(cands, masks)
+        cands['dm_trial'] = np.searchsorted(
+            np.logspace(-1, np.log10(self.dm_max), 1000), cands['dm'])
+        width = 2**cands['filter'].astype(np.int64)
+        cands['begin']   = np.maximum(cands['samp_idx'] - width, 0)
+        cands['end']     = cands['samp_idx'] + width
+        cands['max_snr'] = cands['snr']
+        return cands
+
+    def beam_masks(self, beam):
+        # One bit per beam, as (n, nwords) 64-bit words
+        nwords = (self.nbeams + 63) // 64
+        masks = np.zeros((len(beam), nwords), dtype=np.uint64)
+        masks[np.arange(len(beam)), beam // 64] = \
+            np.left_shift(np.uint64(1), (beam % 64).astype(np.uint64))
+        return masks
+
+    def set_masks(self, cands, masks):
+        cands['nbeams'] = popcount(masks)
+        if masks.shape[1] == 1:
+            cands['beam_mask'] = masks[:,0]
+        else:
+            cands['beam_mask'] = masks
+
+    def format_rows(self, cands):
+        masks = cands['beam_mask']
+        if masks.ndim == 2:
+            words = masks.tolist()
+            masks = [sum(w << (64*i) for i, w in enumerate(row))
+                     for row in words]
+        else:
+            masks = masks.tolist()
+        cols = [cands[name].tolist() if name != 'beam_mask' else masks
+                for name in cands.dtype.names]
+        fmt = '%.5g\t%d\t%.6f\t%d\t%d\t%.5g\t%d\t%d\t%d\t%d\t%d\t%d\t%.5g\t%d\n'
+        return ''.join([fmt % row for row in zip(*cols)])
+
+    def write(self, filename, n):
+        # Written in time order, one slice of the observation per chunk
+        nchunks = max(1, (n + self.chunk - 1) // self.chunk)
+        with open(filename, 'w') as f:
+            for i in range(nchunks):
+                m = n // nchunks + (i < n % nchunks)
+                t0 = self.tobs * i / nchunks
+                t1 = self.tobs * (i + 1) / nchunks
+                f.write(self.format_rows(self.make(m, t0, t1)))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Writes a synthetic Heimdall candidate file.")
+    parser.add_argument('-o', default="fake.cand")
+    parser.add_argument('-n', type=float, default=1e5,
+                        help="number of candidates")
+    parser.add_argument('-nbeams', type=int, default=13)
+    parser.add_argument('-tobs', type=float, default=600.0)
+    parser.add_argument('-rfi_frac', type=float, default=0.05)
+    parser.add_argument('-lowdm_frac', type=float, default=0.10)
+    parser.add_argument('-fat_frac', type=float, default=0.05)
+    parser.add_argument('-seed', type=int)
+    args = parser.parse_args()
+
+    fake = FakeCandidates(args.nbeams, args.seed)
+    fake.tobs = args.tobs
+    fake.rfi_frac = args.rfi_frac
+    fake.lowdm_frac = args.lowdm_frac
+    fake.fat_frac = args.fat_frac
+    fake.write(args.o, int(args.n))
+    print "Wrote %i candidates to %s" % (int(args.n), args.o)
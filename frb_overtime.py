@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+# Name: FRBs over time
+#
+# Description: Builds the per-year, per-telescope discovery table (all_FRBs)
+# plotted by plotFRBovertime.gp from the cached FRB catalogue, in one
+# group-by over (year, telescope), instead of editing it by hand. The
+# events already counted are remembered beside the table, so later runs only
+# add the new ones and keep any rows added by hand (e.g. unpublished FRBs).
+# Also writes all_FRBs.gp with the total, the y range and a plot clause for
+# whichever telescopes are present, and with -plot reruns gnuplot to
+# regenerate FRBovertime.ps/.pdf in the same step.
+
+import os
+import json
+import subprocess
+import numpy as np
+import frb_sky
+
+# Site registry key -> (table column, plot title, extra plot style), in the
+# order the columns are stacked
+telescope_columns = (
+    ('parkes',  'PKS',     'Parkes',  ''),
+    ('utmost',  'UTMOST',  'UTMOST',  ''),
+    ('gbt',     'GBT',     'GBT',     ''),
+    ('arecibo', 'Arecibo', 'Arecibo', ''),
+    ('askap',   'ASKAP',   'ASKAP',   ''),
+    ('chime',   'CHIME',   'CHIME',   'lt 8'),
+    ('dsa',     'DSA',     'DSA-10',  'lt 7'),
+    ('wsrt',    'WSRT',    'WSRT',    "lt rgb '#7FFFD4'"),
+)
+
+def column_label(telescope):
+    # Table column for a catalogue telescope name
+    key = frb_sky.site_key(telescope)
+    for column_key, label, title, style in telescope_columns:
+        if key == column_key:
+            return label
+    name = frb_sky.sites[key][0] if key else telescope
+    return '_'.join(name.split())
+
+def year_telescope_counts(utc, telescopes):
+    # Group-by (year, telescope column): returns years, labels and the
+    # (nyears, nlabels) count table, years running without gaps
+    years = utc.astype('datetime64[Y]').astype(int) + 1970
+    names, tel_index = np.unique(np.asarray(telescopes, dtype=str),
+                                 return_inverse=True)
+    labels, label_index = np.unique([column_label(name) for name in names],
+                                     return_inverse=True)
+    if len(years) == 0:
+        return np.zeros(0, dtype=int), [], np.zeros((0, 0), dtype=int)
+    first = years.min()
+    nyears = years.max() - first + 1
+    cell = (years - first) * len(labels) + label_index[tel_index]
+    counts = np.bincount(cell, minlength=nyears * len(labels))
+    return np.arange(first, first + nyears), list(labels), \
+        counts.reshape(nyears, len(labels))
+
+class DiscoveryTable(object):
+    def __init__(self):
+        self.years  = np.zeros(0, dtype=int)
+        self.labels = []
+        self.counts = np.zeros((0, 0), dtype=int)
+
+    def read(self, filename):
+        # The whitespace-separated all_FRBs format: a header of column
+        # labels, then one row per year
+        with open(filename) as f:
+            lines = [line.split() for line in f if line.strip()]
+        self.labels = lines[0]
+        rows = np.array(lines[1:], dtype=int).reshape(-1, len(self.labels) + 1)
+        self.years = rows[:,0]
+        self.counts = rows[:,1:]
+
+    def add(self, years, labels, counts):
+        # Adds a count table, extending the years and columns as needed
+        if len(years) == 0:
+            return
+        order = [label for key, label, title, style in telescope_columns]
+        new = [label for label in labels if label not in self.labels]
+        all_labels = self.labels + sorted(new, key=lambda label:
+            (order.index(label) if label in order else len(order), label))
+        first, last = years.min(), years.max()
+        if len(self.years):
+            first = min(first, self.years.min())
+            last = max(last, self.years.max())
+        all_years = np.arange(first, last + 1)
+        table = np.zeros((len(all_years), len(all_labels)), dtype=int)
+        for src_years, src_labels, src in ((self.years, self.labels,
+                                            self.counts),
+                                           (years, labels, counts)):
+            if len(src_years) == 0:
+                continue
+            cols = [all_labels.index(label) for label in src_labels]
+            table[np.ix_(src_years - all_years[0], cols)] += src
+        self.years, self.labels, self.counts = all_years, all_labels, table
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            f.write('\t' + '\t'.join(self.labels) + '\n')
+            for year, row in zip(self.years, self.counts):
+                f.write('%i\t' % year + '\t'.join(map(str, row)) + '\n')
+
+    def plot_clause(self, filename):
+        # gnuplot plot command stacking one column per telescope
+        titles = dict((label, (title, style))
+                      for key, label, title, style in telescope_columns)
+        items = []
+        for i, label in enumerate(self.labels):
+            title, style = titles.get(label, (label, ''))
+            using = ('"%s" using %i:xtic(1)' % (filename, i + 2)) if i == 0 \
+                else "'' u %i" % (i + 2)
+            items.append(("%s title '%s' %s" % (using, title, style)).strip())
+        return 'plot ' + ', '.join(items)
+
+    def write_gnuplot(self, filename, table_name):
+        # Variables and the plot clause used by plotFRBovertime.gp
+        totals = self.counts.sum(axis=1)
+        with open(filename, 'w') as f:
+            f.write('# Written by frb_overtime.py from %s\n' % table_name)
+            f.write('num_frbs = %i\n' % self.counts.sum())
+            f.write('max_per_year = %i\n' % (totals.max() if len(totals)
+                                             else 0))
+            f.write('frb_plot = "%s"\n' % self.plot_clause(table_name)
+                    .replace('\\', '\\\\').replace('"', '\\"'))
+
+def update_table(cat, filename="all_FRBs", rebuild=False, seed=False):
+    # Adds the catalogue events not yet in the table; returns the table.
+    # A table without the record of counted events (e.g. one kept by hand)
+    # is only replaced with rebuild; with seed its counts are kept and just
+    # the catalogue events after its last year are added
+    state_name = filename + '.json'
+    table = DiscoveryTable()
+    counted = []
+    if not rebuild and os.path.exists(state_name):
+        with open(state_name) as f:
+            counted = json.load(f)['counted']
+        table.read(filename)
+    elif not rebuild and os.path.exists(filename):
+        if not seed:
+            raise ValueError("%s has no record of the events it counts "
+                             "(%s); use -seed to keep its counts and add "
+                             "later events, or -rebuild to recount it from "
+                             "the catalogue" % (filename, state_name))
+        table.read(filename)
+        if len(table.years):
+            years = cat['utc'].astype('datetime64[Y]').astype(int) + 1970
+            counted = cat['name'][years <= table.years.max()].tolist()
+            print "Keeping the counts in %s up to %i" \
+                % (filename, table.years.max())
+    new = ~np.in1d(cat['name'], counted)
+    table.add(*year_telescope_counts(cat['utc'][new], cat['telescope'][new]))
+    print "Added %i new FRBs to %s" % (new.sum(), filename)
+    table.write(filename)
+    table.write_gnuplot(filename + '.gp', filename)
+    with open(state_name, 'w') as f:
+        json.dump({'counted': sorted(set(counted) |
+                                     set(cat['name'][new].tolist()))}, f)
+    return table
+
+def plot(script="plotFRBovertime.gp", output="FRBovertime.ps"):
+    subprocess.check_call(['gnuplot', script])
+    try:
+        subprocess.check_call(['ps2pdf', output])
+    except OSError:
+        print "ps2pdf not found, only %s was written" % output
+
+if __name__ == "__main__":
+    import argparse
+    from frbcat import load_catalogue, frbcat_url
+    parser = argparse.ArgumentParser(description="Updates the table of FRB discoveries per year and telescope.")
+    parser.add_argument('-catalogue', default="frbcat.csv")
+    parser.add_argument('-url', default=frbcat_url)
+    parser.add_argument('-update', action="store_true",
+                        help="refresh the catalogue from FRBCAT first")
+    parser.add_argument('-o', default="all_FRBs")
+    parser.add_argument('-rebuild', action="store_true",
+                        help="recount every event instead of adding new ones")
+    parser.add_argument('-seed', action="store_true",
+                        help="start counting for a table kept by hand: keep "
+                             "its counts and add the catalogue events after "
+                             "its last year")
+    parser.add_argument('-plot', action="store_true",
+                        help="regenerate the plot with plotFRBovertime.gp")
+    args = parser.parse_args()
+    cat = load_catalogue(args.catalogue, args.url, update=args.update)
+    try:
+        update_table(cat, args.o, args.rebuild, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.plot:
+        plot()
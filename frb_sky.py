@@ -0,0 +1,214 @@
+#!/usr/bin/python
+
+# Name: FRB sky coordinates
+#
+# Description: Batch coordinate conversions for the FRB plots. Whole
+# catalogue columns of RAJ/DECJ sexagesimal strings are parsed in one go and
+# rotated from J2000 equatorial to Galactic coordinates with a single matrix
+# product, instead of building ephem objects one FRB at a time. The results
+# agree with ephem.Galactic to well under an arcsecond. Alt/az at each FRB's
+# telescope comes from the site registry below via sidereal time and hour
+# angle, again for the whole catalogue at once (to within ~30 arcsec of
+# ephem, which also applies nutation and aberration). Sky densities are
+# binned on an equal-area pixel grid by direct pixel arithmetic.
+
+import numpy as np
+
+# J2000 equatorial -> Galactic rotation (Hipparcos, ESA 1997, vol. 1 sec. 1.5.3)
+eq2gal = np.array([[-0.0548755604, -0.8734370902, -0.4838350155],
+                   [ 0.4941094279, -0.4448296300,  0.7469822445],
+                   [-0.8676661490, -0.1980763734,  0.4559837762]])
+
+def parse_sexagesimal(strings):
+    # 'dd:mm:ss.s' (or 'dd:mm', 'dd') strings -> float array in units of the
+    # first field, e.g. hours for RAJ and degrees for DECJ
+    s = np.char.strip(np.asarray(strings, dtype=str))
+    if s.size == 0:
+        return np.zeros(s.shape)
+    negative = np.char.startswith(s, '-')
+    # Pad to three fields so all of them can be read with one fromstring
+    nfields = np.char.count(s, ':') + 1
+    pad = np.array(['', ' 0', ' 0 0'])[np.clip(3 - nfields, 0, 2)]
+    fields = np.char.add(np.char.replace(s, ':', ' '), pad)
+    dms = np.fromstring(' '.join(fields.ravel()), sep=' ')
+    if dms.size != 3 * s.size:
+        raise ValueError("Could not parse sexagesimal values")
+    dms = np.abs(dms.reshape(-1, 3))
+    value = dms[:,0] + dms[:,1]/60.0 + dms[:,2]/3600.0
+    return np.where(negative.ravel(), -value, value).reshape(s.shape)
+
+def radec_to_radians(raj, decj):
+    # RAJ (hours) and DECJ (degrees) strings -> ra, dec [rad]
+    ra = np.radians(15.0 * parse_sexagesimal(raj))
+    dec = np.radians(parse_sexagesimal(decj))
+    return ra, dec
+
+def unit_vectors(lon, lat):
+    # (3, n) direction cosines
+    cos_lat = np.cos(lat)
+    return np.array([cos_lat * np.cos(lon), cos_lat * np.sin(lon),
+                     np.sin(lat)])
+
+def equatorial_to_galactic(ra, dec):
+    # J2000 ra, dec [rad] -> gl, gb [rad], with gl wrapped to [-pi, pi] as
+    # needed for the Aitoff projection
+    x, y, z = np.dot(eq2gal, unit_vectors(np.asarray(ra, dtype=float),
+                                          np.asarray(dec, dtype=float)))
+    gl = np.arctan2(y, x)
+    gb = np.arctan2(z, np.hypot(x, y))
+    return gl, gb
+
+def galactic_coords(raj, decj):
+    # Catalogue RAJ/DECJ strings -> gl, gb [rad]
+    return equatorial_to_galactic(*radec_to_radians(raj, decj))
+
+# Observatory sites: catalogue telescope name -> (place, east longitude,
+# latitude [deg or dd:mm:ss], elevation [m])
+sites = {
+    'parkes':     ("Parkes Observatory",    '148:15:44.3', '-32:59:59.8', 0),
+    'gbt':        ("Green Bank Telescope",  '-79:50:23',   '38:25:59',    0),
+    'arecibo':    ("Arecibo",               '-66:45:10',   '18:20:39',    0),
+    'utmost':     ("Molonglo",              '149:25:26.8', '-35:22:14.5', 0),
+    'askap':      ("MRO (ASKAP)",           '116:38:13.0', '-26:41:46.0', 0),
+    'chime':      ("DRAO (CHIME)",          '-119:37:25.3', '49:19:14.5', 0),
+    'dsa':        ("OVRO (DSA)",            '-118:16:59.0', '37:14:02.0', 0),
+    'wsrt':       ("Westerbork",            '6:36:12.0',   '52:54:55.0',  0),
+    'fast':       ("FAST",                  '106:51:24.0', '25:39:10.6',  0),
+    'effelsberg': ("Effelsberg",            '6:52:58.2',   '50:31:28.6',  0),
+    'vla':        ("Very Large Array",      '-107:37:06.0', '34:04:43.5', 0),
+    'meerkat':    ("MeerKAT",               '21:26:38.0',  '-30:42:39.8', 0),
+    'pushchino':  ("Pushchino",             '37:37:36.0',  '54:49:24.0',  0),
+    'lovell':     ("Jodrell Bank",          '-2:18:30.9',  '53:14:10.5',  0),
+    'ata':        ("Allen Telescope Array", '-121:28:24.0', '40:49:03.0', 0),
+    'lofar':      ("LOFAR core",            '6:52:08.2',   '52:54:31.6',  0),
+}
+
+# Other spellings of the telescope names found in the catalogue
+site_aliases = {'pks': 'parkes', 'green bank': 'gbt', 'molonglo': 'utmost',
+                'chime/frb': 'chime', 'dsa-10': 'dsa', 'dsa-110': 'dsa',
+                'apertif': 'wsrt', 'jodrell bank': 'lovell',
+                'lovell telescope': 'lovell'}
+
+def site_key(telescope):
+    # Registry key for a catalogue telescope name, or None if unknown
+    name = telescope.strip().lower()
+    name = site_aliases.get(name, name)
+    return name if name in sites else None
+
+def site_keys(telescopes):
+    # Registry keys for a column of telescope names ('' where unknown),
+    # looked up once per distinct name
+    names, inverse = np.unique(np.asarray(telescopes, dtype=str),
+                               return_inverse=True)
+    keys = np.array([site_key(name) or '' for name in names] + [''])
+    return keys[inverse]
+
+def site_arrays(telescopes):
+    # Per-FRB east longitude and latitude [rad], NaN for unknown sites
+    keys, inverse = np.unique(site_keys(telescopes), return_inverse=True)
+    lon = np.full(len(keys), np.nan)
+    lat = np.full(len(keys), np.nan)
+    for i, key in enumerate(keys):
+        if key:
+            place, site_lon, site_lat, elevation = sites[key]
+            lon[i] = np.radians(parse_sexagesimal(site_lon))
+            lat[i] = np.radians(parse_sexagesimal(site_lat))
+    return lon[inverse], lat[inverse]
+
+def parse_utc(strings):
+    # Catalogue UTC strings ('2001/01/25 00:29:15.790' or ISO) -> datetime64
+    s = np.char.strip(np.asarray(strings, dtype=str))
+    s = np.char.replace(np.char.replace(s, '/', '-'), ' ', 'T')
+    return s.astype('datetime64[ms]')
+
+def days_since_j2000(utc):
+    return (utc - np.datetime64('2000-01-01T12:00:00', 'ms')) \
+        / np.timedelta64(86400000, 'ms')
+
+def gmst(utc):
+    # Greenwich mean sidereal time [rad] (IAU 1982, UT1 taken as UTC)
+    d = days_since_j2000(utc)
+    t = d / 36525.0
+    deg = 280.46061837 + 360.98564736629*d + 0.000387933*t*t - t*t*t/38710000.0
+    return np.radians(np.mod(deg, 360.0))
+
+def precess_from_j2000(ra, dec, utc):
+    # J2000 ra, dec -> mean ra, dec of date (IAU 1976 precession), with one
+    # rotation matrix per FRB
+    t = days_since_j2000(utc) / 36525.0
+    arcsec = np.pi / (180.0*3600.0)
+    zeta  = (2306.2181*t + 0.30188*t*t + 0.017998*t*t*t) * arcsec
+    z     = (2306.2181*t + 1.09468*t*t + 0.018203*t*t*t) * arcsec
+    theta = (2004.3109*t - 0.42665*t*t - 0.041833*t*t*t) * arcsec
+    cz, sz = np.cos(z), np.sin(z)
+    ct, st = np.cos(theta), np.sin(theta)
+    cx, sx = np.cos(zeta), np.sin(zeta)
+    p = np.array([[ cz*ct*cx - sz*sx, -cz*ct*sx - sz*cx, -cz*st],
+                  [ sz*ct*cx + cz*sx, -sz*ct*sx + cz*cx, -sz*st],
+                  [ st*cx,            -st*sx,             ct   ]])
+    x, y, zz = np.einsum('ijn,jn->in', p, unit_vectors(ra, dec))
+    return np.arctan2(y, x), np.arctan2(zz, np.hypot(x, y))
+
+def altaz(ra, dec, utc, site_lon, site_lat):
+    # Geometric alt, az [rad] (az from north through east) of J2000 positions
+    # seen from the given sites at the given times; no refraction
+    ra, dec = precess_from_j2000(ra, dec, utc)
+    ha = gmst(utc) + site_lon - ra
+    sin_lat, cos_lat = np.sin(site_lat), np.cos(site_lat)
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+    alt = np.arcsin(sin_dec*sin_lat + cos_dec*cos_lat*np.cos(ha))
+    az = np.arctan2(-cos_dec*np.sin(ha), sin_dec*cos_lat
+                    - cos_dec*sin_lat*np.cos(ha))
+    return alt, np.mod(az, 2.0*np.pi)
+
+def catalogue_altaz(raj, decj, utc, telescopes):
+    # Catalogue RAJ/DECJ/UTC/Telescope columns -> alt, az [rad], NaN where
+    # the telescope isn't in the site registry
+    ra, dec = radec_to_radians(raj, decj)
+    site_lon, site_lat = site_arrays(telescopes)
+    return altaz(ra, dec, parse_utc(utc), site_lon, site_lat)
+
+# Equal-area sky pixels: nlat bands equally spaced in sin(latitude), each cut
+# into 2*nlat equal slices of longitude, so every pixel covers
+# 4*pi/(2*nlat**2) sr and pixel counts are densities as they stand
+
+def pixel_edges(nlat=36):
+    # Longitude and latitude edges [rad] of the pixels, longitude in
+    # [-pi, pi] as from equatorial_to_galactic
+    return (np.linspace(-np.pi, np.pi, 2*nlat + 1),
+            np.arcsin(np.linspace(-1.0, 1.0, nlat + 1)))
+
+def pixel_centres(pixels, nlat=36):
+    iy, ix = np.divmod(pixels, 2*nlat)
+    return (-np.pi + (ix + 0.5) * np.pi / nlat,
+            np.arcsin(-1.0 + (iy + 0.5) * 2.0 / nlat))
+
+def sky_pixels(lon, lat, nlat=36):
+    # Pixel number (band * 2*nlat + slice) of each position; -1 for NaNs
+    nlon = 2*nlat
+    ok = np.isfinite(lon) & np.isfinite(lat)
+    ix = np.floor((np.where(ok, lon, 0.0) + np.pi) / (2.0*np.pi) * nlon)
+    iy = np.floor((np.sin(np.where(ok, lat, 0.0)) + 1.0) / 2.0 * nlat)
+    pixels = (np.clip(iy, 0, nlat - 1) * nlon +
+              np.clip(ix, 0, nlon - 1)).astype(np.intp)
+    pixels[~ok] = -1
+    return pixels
+
+def sky_density(pixels, nlat=36, layers=None, nlayers=1):
+    # Counts per pixel as (nlayers, nlat, 2*nlat) images, split by the
+    # given layer number of each position (e.g. its telescope) in a single
+    # bincount
+    npix = 2*nlat*nlat
+    ok = pixels >= 0
+    cell = pixels[ok] if layers is None else layers[ok]*npix + pixels[ok]
+    counts = np.bincount(cell, minlength=nlayers*npix)
+    return counts.reshape(nlayers, nlat, 2*nlat)
+
+def label_pixels(pixels, max_labels=20):
+    # Declutters labels to at most one per pixel and max_labels in all:
+    # returns the busiest pixels, the first position in each and its count
+    ok = np.flatnonzero(pixels >= 0)
+    occupied, first, counts = np.unique(pixels[ok], return_index=True,
+                                        return_counts=True)
+    busiest = np.argsort(-counts, kind='mergesort')[:max_labels]
+    return occupied[busiest], ok[first[busiest]], counts[busiest]
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+# Name: FRB catalogue cache
+#
+# Description: Keeps a local copy of the FRBCAT CSV and a parsed, typed
+# column store made from it. A refresh is a conditional HTTP request
+# (If-None-Match/If-Modified-Since) and the CSV is only rewritten when the
+# content hash changes, so an unchanged catalogue costs one round trip. The
+# columns, including the Galactic coordinates and parsed UTC, are kept in an
+# uncompressed .npz beside the CSV and reloaded without reparsing for as long
+# as the CSV is unchanged. The URL can point anywhere, e.g. a local server
+# for testing.
+
+import os
+import csv
+import json
+import hashlib
+import numpy as np
+import frb_sky
+
+frbcat_url = "http://www.astronomy.swin.edu.au/pulsar/frbcat/table.php?format=text&amp;sep=comma"
+
+# Catalogue column -> column store name
+columns = (('Name', 'name'), ('RAJ', 'raj'), ('DECJ', 'decj'),
+           ('UTC', 'utc_str'), ('Telescope', 'telescope'))
+
+class FRBCatalogue(object):
+    def __init__(self, filename="frbcat.csv", url=frbcat_url):
+        self.filename = filename
+        self.url      = url
+        self.timeout  = 60.0 # [s]
+
+    def meta_name(self):
+        return self.filename + '.json'
+
+    def store_name(self):
+        return self.filename + '.npz'
+
+    def read_meta(self):
+        try:
+            with open(self.meta_name()) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write_meta(self, meta):
+        with open(self.meta_name(), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    def file_sha1(self):
+        sha1 = hashlib.sha1()
+        with open(self.filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def csv_sha1(self):
+        # Hash of the CSV on disk, recomputed only if it was touched since
+        # the last download (e.g. edited by hand)
+        meta = self.read_meta()
+        st = os.stat(self.filename)
+        if meta.get('size') == st.st_size and meta.get('mtime') == st.st_mtime \
+           and 'sha1' in meta:
+            return meta['sha1']
+        meta.update(sha1=self.file_sha1(), size=st.st_size, mtime=st.st_mtime)
+        self.write_meta(meta)
+        return meta['sha1']
+
+    def fetch(self):
+        # Refreshes the CSV from the URL; returns True if its content changed
+        import urllib2
+        meta = self.read_meta()
+        request = urllib2.Request(self.url)
+        if os.path.exists(self.filename):
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError as e:
+            if e.code == 304:
+                print "FRB catalogue is up to date"
+                return False
+            raise
+        body = response.read()
+        etag = response.info().getheader('ETag')
+        last_modified = response.info().getheader('Last-Modified')
+        sha1 = hashlib.sha1(body).hexdigest()
+        if os.path.exists(self.filename) and self.csv_sha1() == sha1:
+            # Same content; just keep the new validators for next time
+            meta = self.read_meta()
+            meta.update(etag=etag, last_modified=last_modified)
+            self.write_meta(meta)
+            print "FRB catalogue is unchanged"
+            return False
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.rename(tmp, self.filename)
+        st = os.stat(self.filename)
+        self.write_meta({'etag': etag, 'last_modified': last_modified,
+                         'sha1': sha1, 'size': st.st_size,
+                         'mtime': st.st_mtime})
+        print "Downloaded FRB catalogue to %s" % self.filename
+        return True
+
+    def parse(self):
+        # CSV -> dict of typed column arrays
+        with open(self.filename, 'rb') as f:
+            reader = csv.reader(f)
+            header = [name.strip() for name in reader.next()]
+            rows = [row for row in reader if row]
+        fields = zip(*rows) if rows else [()] * len(header)
+        cat = {}
+        for name, key in columns:
+            cat[key] = np.array(fields[header.index(name)], dtype=str)
+        cat['utc'] = frb_sky.parse_utc(cat['utc_str'])
+        cat['ra'], cat['dec'] = frb_sky.radec_to_radians(cat['raj'],
+                                                         cat['decj'])
+        cat['gl'], cat['gb'] = frb_sky.equatorial_to_galactic(cat['ra'],
+                                                              cat['dec'])
+        return cat
+
+    def load(self):
+        # The column store if it matches the CSV, otherwise (re)built
+        sha1 = self.csv_sha1()
+        try:
+            with np.load(self.store_name()) as store:
+                if str(store['sha1']) == sha1:
+                    return dict((key, store[key]) for key in store.files
+                                if key != 'sha1')
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+        cat = self.parse()
+        tmp = self.store_name() + '.tmp.npz'
+        np.savez(tmp, sha1=np.array(sha1), **cat)
+        os.rename(tmp, self.store_name())
+        return cat
+
+def load_catalogue(filename="frbcat.csv", url=frbcat_url, update=False):
+    catalogue = FRBCatalogue(filename, url)
+    if update or not os.path.exists(filename):
+        try:
+            catalogue.fetch()
+        except IOError as e:
+            # urllib2's errors are IOErrors; carry on with the old copy
+            if not os.path.exists(filename):
+                raise
+            print "Could not refresh the FRB catalogue (%s), using %s" \
+                % (e, filename)
+    return catalogue.load()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Refreshes the local FRB catalogue and its column store.")
+    parser.add_argument('-f', default="frbcat.csv")
+    parser.add_argument('-url', default=frbcat_url)
+    args = parser.parse_args()
+    cat = load_catalogue(args.f, args.url, update=True)
+    print "%i FRBs in %s" % (len(cat['name']), args.f)
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+# Name: Binary gnuplot data
+#
+# Description: Drop-in replacements for Gnuplot.Data that hand NumPy data to
+# gnuplot as raw binary records instead of formatting every value as text.
+# Data() packs its columns into one contiguous float32 buffer. RecordData()
+# writes a structured (record) array as-is and uses gnuplot's format skips
+# to read just the requested fields, so no per-column copy is made. Both take
+# the same using/with_/title options as Gnuplot.Data and number the columns
+# in the order they are given.
+
+import os
+import tempfile
+import numpy as np
+import Gnuplot, Gnuplot.PlotItems
+
+# Set to False to fall back to Gnuplot.Data's text transfer
+enabled = True
+
+# Temporary data files not yet known to have been read by gnuplot
+pending = []
+
+def cleanup():
+    # Removes the temporary data files; call once gnuplot has caught up
+    while pending:
+        try:
+            os.unlink(pending.pop())
+        except OSError:
+            pass
+
+gnuplot_types = {'f4': 'float32', 'f8': 'float64',
+                 'i1': 'int8',    'u1': 'uint8',
+                 'i2': 'int16',   'u2': 'uint16',
+                 'i4': 'int32',   'u4': 'uint32',
+                 'i8': 'int64',   'u8': 'uint64'}
+
+def field_format(dtype, skip=False):
+    base = dtype.base
+    key = '%s%i' % (base.kind, base.itemsize)
+    if base.byteorder == '>' or key not in gnuplot_types:
+        return None
+    return (('%*' if skip else '%') + gnuplot_types[key]) \
+        * int(np.prod(dtype.shape))
+
+def record_format(dtype, fields):
+    # gnuplot binary format string that reads the given fields (in record
+    # order) from records of dtype and skips everything else, or None if
+    # the layout can't be described
+    layout = sorted((offset, name, ftype)
+                    for name, (ftype, offset) in dtype.fields.items())
+    if [name for offset, name, ftype in layout if name in fields] \
+       != list(fields):
+        return None
+    fmt, pos = [], 0
+    for offset, name, ftype in layout:
+        if offset > pos:
+            fmt.append('%*int8' * (offset - pos))
+        f = field_format(ftype, skip=name not in fields)
+        if f is None:
+            return None
+        fmt.append(f)
+        pos = offset + ftype.itemsize
+    if pos < dtype.itemsize:
+        fmt.append('%*int8' * (dtype.itemsize - pos))
+    return ''.join(fmt)
+
+class BinaryData(Gnuplot.PlotItems._FileItem):
+    # A temporary binary file plotted with a binary record/format clause, or
+    # with the given binary clause (e.g. an array for images)
+    def __init__(self, buf, fmt, spec=None, **keyw):
+        fd, filename = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'wb') as f:
+            buf.tofile(f)
+        self.binary_spec = spec or \
+            'binary record=(%i) format="%s"' % (len(buf), fmt)
+        Gnuplot.PlotItems._FileItem.__init__(self, filename, **keyw)
+        # gnuplot may read the file after this item has been dropped, so
+        # it is only removed by cleanup()
+        pending.append(filename)
+
+    def get_base_command_string(self):
+        return '%s %s' % (
+            Gnuplot.PlotItems._FileItem.get_base_command_string(self),
+            self.binary_spec)
+
+
+def Data(*columns, **keyw):
+    n = len(columns[0]) if columns else 0
+    if not enabled or n == 0:
+        return Gnuplot.Data(*columns, **keyw)
+    buf = np.empty((n, len(columns)), dtype=np.float32)
+    for i, col in enumerate(columns):
+        buf[:,i] = col
+    return BinaryData(buf, '%float32' * len(columns), **keyw)
+
+def ImageData(image, origin, step, **keyw):
+    # A regular grid of uint8 pixels, shape (ny, nx) or (ny, nx, channels),
+    # for 'with image' or 'with rgbimage'. origin is the (x, y) centre of
+    # the first pixel and step the pixel size. Sent as one binary array, so
+    # its size only depends on the grid.
+    ny, nx = image.shape[:2]
+    nchannels = image.shape[2] if image.ndim == 3 else 1
+    if not enabled:
+        x = origin[0] + step[0]*np.arange(nx)
+        y = origin[1] + step[1]*np.arange(ny)
+        pixels = image.reshape(ny*nx, nchannels)
+        return Gnuplot.Data(np.tile(x, ny), np.repeat(y, nx),
+                            *[pixels[:,c] for c in range(nchannels)], **keyw)
+    spec = 'binary array=(%i,%i) format="%s" origin=(%.9g,%.9g) ' \
+           'dx=%.9g dy=%.9g' % ((nx, ny, '%uint8' * nchannels) +
+                                tuple(origin) + tuple(step))
+    return BinaryData(np.ascontiguousarray(image, dtype=np.uint8), None,
+                      spec, **keyw)
+
+def RecordData(records, fields, **keyw):
+    fmt = record_format(records.dtype, fields)
+    if not enabled or len(records) == 0 or fmt is None:
+        return Data(*[records[name] for name in fields], **keyw)
+    return BinaryData(np.ascontiguousarray(records), fmt, **keyw)
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+# Name: Heimdall binary candidate format
+#
+# Description: A self-describing binary form of Heimdall candidate files
+# (.hcb) that loads as a memory map instead of being parsed. The file starts
+# with a fixed preamble and a JSON header giving the record schema, beam
+# count, beam numbering and any observation metadata, padded so the records
+# start on a page boundary. The records follow as one contiguous array.
+# Writers append them a chunk at a time and only then update the row count
+# in the preamble, so readers (and a crashed writer's successor) never see a
+# partly written chunk. Also converts .cand text files.
+#
+# Preamble, little-endian:
+#   0  8s  magic "HEIMCAND"
+#   8  u2  format version
+#   10 u2  reserved
+#   12 u4  header size in bytes, including the preamble (records start here)
+#   16 u8  committed number of records
+#   24 u8  number of chunks written
+#   32     JSON header, NUL-padded to the header size
+
+import os
+import json
+import struct
+import time
+import numpy as np
+from heimdall_cands import CandidateLoader, make_cand_dtype, \
+    make_compact_dtype, check_fits
+
+magic = "HEIMCAND"
+version = 1
+preamble = struct.Struct('<8sHHIQQ')
+header_align = 4096
+
+def is_binary(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(magic)) == magic
+    except IOError:
+        return False
+
+def dtype_from_descr(descr):
+    # Inverse of json.dumps(dtype.descr), which turns tuples into lists
+    return np.dtype([tuple(field[:2]) + tuple(tuple(shape)
+                                              for shape in field[2:])
+                     for field in descr])
+
+class CandidateReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            head = f.read(preamble.size)
+            if len(head) < preamble.size or head[:len(magic)] != magic:
+                raise ValueError("%s is not a binary candidate file"
+                                 % filename)
+            (_, file_version, _, self.data_offset, self.nrows,
+             self.nchunks) = preamble.unpack(head)
+            if file_version > version:
+                raise ValueError("%s has format version %i, newer than %i"
+                                 % (filename, file_version, version))
+            header = json.loads(f.read(self.data_offset - preamble.size)
+                                .rstrip('\0'))
+        self.dtype     = dtype_from_descr(header['fields'])
+        self.nbeams    = header['nbeams']
+        self.beam_base = header['beam_base']
+        self.meta      = header['meta']
+
+    def refresh(self):
+        # Picks up chunks appended since the file was opened
+        with open(self.filename, 'rb') as f:
+            (_, _, _, _, self.nrows, self.nchunks) = \
+                preamble.unpack(f.read(preamble.size))
+        return self.nrows
+
+    def read(self, start=0, stop=None):
+        # Records start:stop read into memory
+        stop = self.nrows if stop is None else min(stop, self.nrows)
+        with open(self.filename, 'rb') as f:
+            f.seek(self.data_offset + start * self.dtype.itemsize)
+            return np.fromfile(f, dtype=self.dtype,
+                               count=max(stop - start, 0))
+
+    def chunks(self, rows=1<<20, start=0):
+        # Streams the records rows at a time
+        for i in range(start, self.nrows, rows):
+            yield self.read(i, i + rows)
+
+    def map(self):
+        # All committed records, memory-mapped copy-on-write so callers may
+        # adjust columns in place without touching the file
+        if self.nrows == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(self.filename, dtype=self.dtype, mode='c',
+                         offset=self.data_offset, shape=(self.nrows,))
+
+class CandidateWriter(object):
+    # Creates a binary candidate file, or with append=True adds to an
+    # existing one with the same schema
+    def __init__(self, filename, dtype=None, nbeams=13, beam_base=1,
+                 meta=None, append=False):
+        self.filename = filename
+        if append and os.path.exists(filename):
+            reader = CandidateReader(filename)
+            if dtype is not None and np.dtype(dtype) != reader.dtype:
+                raise ValueError("%s holds %s records, not %s"
+                                 % (filename, reader.dtype, np.dtype(dtype)))
+            self.dtype       = reader.dtype
+            self.data_offset = reader.data_offset
+            self.nrows       = reader.nrows
+            self.nchunks     = reader.nchunks
+            self.f = open(filename, 'r+b')
+            # Drop anything past the committed records (e.g. from a writer
+            # that was interrupted)
+            self.f.truncate(self.data_offset +
+                            self.nrows * self.dtype.itemsize)
+        else:
+            self.dtype = make_cand_dtype(nbeams) if dtype is None \
+                else np.dtype(dtype)
+            header = json.dumps({'fields': self.dtype.descr,
+                                 'nbeams': nbeams,
+                                 'beam_base': beam_base,
+                                 'meta': meta or {}}, sort_keys=True)
+            size = preamble.size + len(header)
+            self.data_offset = -(-size // header_align) * header_align
+            self.nrows = self.nchunks = 0
+            self.f = open(filename, 'w+b')
+            self.f.write(preamble.pack(magic, version, 0, self.data_offset,
+                                       0, 0))
+            self.f.write(header)
+            self.f.write('\0' * (self.data_offset - size))
+            self.f.flush()
+
+    def write(self, cands):
+        # Appends one chunk of records and commits it
+        cands = np.asarray(cands)
+        if cands.dtype != self.dtype:
+            raise ValueError("Expected %s records, got %s"
+                             % (self.dtype, cands.dtype))
+        if len(cands) == 0:
+            return
+        self.f.seek(self.data_offset + self.nrows * self.dtype.itemsize)
+        cands.tofile(self.f)
+        self.f.flush()
+        self.nrows += len(cands)
+        self.nchunks += 1
+        # The new records are on disk before the count that exposes them
+        os.fsync(self.f.fileno())
+        self.f.seek(16)
+        self.f.write(struct.pack('<QQ', self.nrows, self.nchunks))
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def convert_text(textname, binname, nbeams=13, meta=None):
+    # Writes a .cand text file out as a binary candidate file, a parse
+    # chunk at a time; returns the number of records
+    loader = CandidateLoader()
+    loader.dtype = make_cand_dtype(nbeams)
+    st = os.stat(textname)
+    info = {'source': os.path.abspath(textname), 'source_size': st.st_size,
+            'source_mtime': st.st_mtime,
+            'converted': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+    info.update(meta or {})
+    with open(textname, 'rb') as f:
+        with CandidateWriter(binname, loader.dtype, nbeams, 1, info) as out:
+            for cands, offset in loader.iter_chunks(f):
+                out.write(cands)
+            return out.nrows
+
+def load_binary(filename, nbeams=32, fields=None):
+    # As heimdall_cands.load_candidates: all columns as stored (a memory
+    # map, with 1-based beams), or with fields just those columns in the
+    # compact formats with 0-based beams
+    reader = CandidateReader(filename)
+    cands = reader.map()
+    if fields is None:
+        if reader.beam_base != 1:
+            cands['beam'] += 1 - reader.beam_base
+            cands['prim_beam'] += 1 - reader.beam_base
+        return cands
+    dtype = make_compact_dtype(fields, max(nbeams, reader.nbeams))
+    if 'beam_mask' in dtype.names:
+        # Keep the stored mask width
+        descr = [(name, reader.dtype.fields[name][0] if name == 'beam_mask'
+                  else dtype.fields[name][0]) for name in dtype.names]
+        dtype = np.dtype(descr)
+    out = np.empty(len(cands), dtype=dtype)
+    for name in dtype.names:
+        col = cands[name]
+        if name in ('beam', 'prim_beam') and reader.beam_base != 0:
+            col = col - reader.beam_base
+        if name != 'beam_mask':
+            check_fits(col, dtype.fields[name][0], name)
+        out[name] = col
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Converts Heimdall candidate text files to the binary candidate format, or describes binary files.")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-nbeams', type=int, default=13)
+    parser.add_argument('-o', help="output file (default: input name with "
+                                   ".hcb); only with one input")
+    parser.add_argument('-meta', nargs='+', default=[], metavar="KEY=VALUE",
+                        help="observation metadata to store in the header")
+    parser.add_argument('-info', action="store_true",
+                        help="print the header of binary files")
+    args = parser.parse_args()
+    if args.o and len(args.files) > 1:
+        parser.error("-o takes a single input file")
+    if any('=' not in item for item in args.meta):
+        parser.error("-meta items are KEY=VALUE")
+    for filename in args.files:
+        if args.info:
+            reader = CandidateReader(filename)
+            print "%s: %i candidates in %i chunks, %i beams (from %i)" \
+                % (filename, reader.nrows, reader.nchunks, reader.nbeams,
+                   reader.beam_base)
+            print "  fields: %s" % ", ".join(
+                ["%s %s" % (name, reader.dtype.fields[name][0])
+                 for name in reader.dtype.names])
+            for key, value in sorted(reader.meta.items()):
+                print "  %s = %s" % (key, value)
+            continue
+        meta = dict(item.split('=', 1) for item in args.meta)
+        binname = args.o or os.path.splitext(filename)[0] + '.hcb'
+        n = convert_text(filename, binname, args.nbeams, meta)
+        print "Wrote %i candidates to %s" % (n, binname)
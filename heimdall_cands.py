@@ -0,0 +1,382 @@
+#!/usr/bin/python
+
+# Name: Heimdall candidate loader
+#
+# Description: Reads Heimdall candidate files (e.g. candidates_all.cand) into
+# the 14-field record array used by superb_overview_plotter.py. The text is
+# parsed in fixed-size chunks and written to a binary sidecar next to the
+# candidate file, keyed on the file size and mtime. Later runs memory-map the
+# sidecar instead of re-parsing, and a file that has only grown since the last
+# run has just its new tail parsed. A compact mode keeps only the columns a
+# caller needs, with the small integer columns narrowed to one or two bytes
+# and the beam numbers made 0-based as they are parsed. Files in the binary
+# candidate format of heimdall_binary.py are loaded from there instead.
+# CandidateIndex adds a time-ordered block index for fast time x DM x S/N
+# window queries.
+
+import os
+import json
+import zlib
+import numpy as np
+
+def make_cand_dtype(nbeams=32):
+    # The beam mask holds one bit per beam: 4 bytes for up to 32 beams,
+    # 8 for up to 64, and a sub-array of 64-bit words beyond that
+    if nbeams <= 32:
+        mask_format = 'u4'
+    elif nbeams <= 64:
+        mask_format = 'u8'
+    else:
+        mask_format = ('u8', ((nbeams + 63) // 64,))
+    return np.dtype({'names': ('snr','samp_idx','time','filter',
+                               'dm_trial','dm','members','begin','end',
+                               'nbeams','beam_mask','prim_beam',
+                               'max_snr','beam'),
+                     'formats': ('f4', 'i4', 'f4', 'i4',
+                                 'i4', 'f4', 'i4', 'i4', 'i4',
+                                 'i4', mask_format, 'i4',
+                                 'f4', 'i4')})
+
+cand_dtype = make_cand_dtype()
+
+# The columns of a candidate file, in order
+cand_fields = cand_dtype.names
+
+# Number of set bits in every possible byte
+popcount_table = np.array([bin(i).count('1') for i in range(256)],
+                          dtype=np.uint8)
+
+def popcount(masks):
+    # Counts set bits per row of an integer array of any width, or per row
+    # of a 2-D array of mask words, with one table lookup per byte
+    masks = np.ascontiguousarray(masks)
+    nbytes = masks.itemsize * int(np.prod(masks.shape[1:]))
+    bytes_ = masks.view(np.uint8).reshape(len(masks), nbytes)
+    return popcount_table[bytes_].sum(axis=1, dtype=np.uint16)
+
+def make_compact_dtype(fields=cand_fields, nbeams=32):
+    # The given columns only (in file order), with one or two byte formats
+    # for the columns that fit. Beam numbers stay signed so a 0 (no beam)
+    # still compares as out of range once made 0-based.
+    full = make_cand_dtype(nbeams)
+    narrow = {'filter':    'u1',
+              'dm_trial':  'u2',
+              'nbeams':    'u1' if nbeams < 256 else 'u2',
+              'prim_beam': 'i1' if nbeams < 128 else 'i2',
+              'beam':      'i1' if nbeams < 128 else 'i2'}
+    names = [name for name in cand_fields if name in fields]
+    return np.dtype({'names': names,
+                     'formats': [narrow.get(name, full.fields[name][0])
+                                 for name in names]})
+
+def check_fits(values, dtype, name):
+    # Raises if values would wrap when stored in a narrow integer column
+    # (e.g. beam numbers past 127 in the one byte beam column of a compact
+    # table made for fewer beams)
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iu' or dtype.itemsize >= 4 or len(values) == 0:
+        return
+    info = np.iinfo(dtype)
+    lo, hi = values.min(), values.max()
+    if lo < info.min or hi > info.max:
+        raise ValueError("%s values %i to %i do not fit the %s column; "
+                         "give the real number of beams (-nbeams)"
+                         % (name, lo, hi, dtype))
+
+def parse_text(buf, dtype=cand_dtype, zero_based=False):
+    # buf must hold whole lines only; every value (including the integer
+    # fields) is exactly representable as a float64, except for beam masks
+    # wider than 32 bits which are parsed separately. dtype may hold any
+    # subset of the columns; with zero_based the beam numbers are shifted
+    # down by one in the same pass.
+    vals = np.fromstring(buf, dtype=np.float64, sep=' ')
+    ncols = len(cand_fields)
+    if len(vals) % ncols != 0:
+        raise ValueError("Malformed candidate data: %i values is not a "
+                         "multiple of %i columns" % (len(vals), ncols))
+    vals = vals.reshape(-1, ncols)
+    cands = np.empty(len(vals), dtype=dtype)
+    mask_dtype = dtype.fields['beam_mask'][0] \
+        if 'beam_mask' in dtype.names else np.dtype('u4')
+    wide_mask = mask_dtype.itemsize > 4
+    for name in dtype.names:
+        i = cand_fields.index(name)
+        if zero_based and name in ('beam', 'prim_beam'):
+            col = vals[:,i] - 1
+        elif name != 'beam_mask' or not wide_mask:
+            col = vals[:,i]
+        else:
+            continue
+        check_fits(col, dtype.fields[name][0], name)
+        cands[name] = col
+    if wide_mask:
+        toks = buf.split()[cand_fields.index('beam_mask')::ncols]
+        if mask_dtype.shape == ():
+            cands['beam_mask'] = [int(t) for t in toks]
+        else:
+            masks = np.array([int(t) for t in toks], dtype=object)
+            for w in range(mask_dtype.shape[0]):
+                cands['beam_mask'][:,w] = (masks >> (64*w)) & ((1<<64) - 1)
+    return cands
+
+class CandidateLoader(object):
+    def __init__(self):
+        self.chunk_bytes = 32<<20 # ~300k lines per parse chunk
+        self.use_cache   = True
+        self.crc_bytes   = 4096
+        self.dtype       = cand_dtype
+        self.zero_based  = False # store beam numbers from 0, not 1
+
+    def layout(self):
+        # Identifies the sidecar record format
+        descr = repr(self.dtype.descr)
+        return descr + ' 0-based' if self.zero_based else descr
+
+    def sidecar_names(self, filename):
+        # Compact layouts get their own sidecar so that runs in either mode
+        # don't keep rebuilding each other's
+        if self.dtype == cand_dtype and not self.zero_based:
+            return filename + '.bin', filename + '.bin.json'
+        base = '%s.%08x.bin' % (filename,
+                                zlib.crc32(self.layout()) & 0xffffffff)
+        return base, base + '.json'
+
+    def iter_chunks(self, f, offset=0):
+        # Yields (records, end_offset) for each run of complete lines from
+        # offset onwards. A trailing partial line (file still being written)
+        # is left for the next call.
+        f.seek(offset)
+        rest = ''
+        while True:
+            buf = f.read(self.chunk_bytes)
+            if not buf:
+                break
+            buf = rest + buf
+            end = buf.rfind('\n') + 1
+            rest = buf[end:]
+            offset += end
+            if end > 0:
+                yield parse_text(buf[:end], self.dtype,
+                                 self.zero_based), offset
+
+    def tail_crc(self, f, offset):
+        start = max(0, offset - self.crc_bytes)
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start)) & 0xffffffff
+
+    def read_meta(self, metaname):
+        try:
+            with open(metaname) as m:
+                return json.load(m)
+        except (IOError, ValueError):
+            return None
+
+    def load(self, filename):
+        if not self.use_cache:
+            return self.load_direct(filename)
+        binname, metaname = self.sidecar_names(filename)
+        st = os.stat(filename)
+        meta = self.read_meta(metaname)
+        try:
+            if meta is not None and os.path.exists(binname) and \
+               meta['dtype'] == self.layout() and \
+               meta['size'] == st.st_size and meta['mtime'] == st.st_mtime:
+                return self.map_sidecar(binname, meta['nrows'])
+            return self.update_sidecar(filename, st, meta)
+        except (IOError, OSError):
+            # e.g. a read-only data directory; fall back to plain parsing
+            return self.load_direct(filename)
+
+    def load_direct(self, filename):
+        with open(filename, 'rb') as f:
+            chunks = [c for c, offset in self.iter_chunks(f)]
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    def map_sidecar(self, binname, nrows):
+        if nrows == 0:
+            return np.empty(0, dtype=self.dtype)
+        # Copy-on-write so callers may adjust columns in place without
+        # touching the cache on disk
+        return np.memmap(binname, dtype=self.dtype, mode='c', shape=(nrows,))
+
+    def update_sidecar(self, filename, st, meta):
+        binname, metaname = self.sidecar_names(filename)
+        with open(filename, 'rb') as f:
+            offset, nrows = 0, 0
+            # Only parse the new tail if the file has grown and the already
+            # parsed region is unchanged
+            if meta is not None and os.path.exists(binname) and \
+               meta['dtype'] == self.layout() and \
+               meta['offset'] <= st.st_size and \
+               self.tail_crc(f, meta['offset']) == meta['crc']:
+                offset, nrows = meta['offset'], meta['nrows']
+            with open(binname, 'r+b' if nrows > 0 else 'wb') as out:
+                # Discard anything past the last recorded row (e.g. from an
+                # interrupted update)
+                out.truncate(nrows * self.dtype.itemsize)
+                out.seek(0, os.SEEK_END)
+                for cands, offset in self.iter_chunks(f, offset):
+                    out.write(cands.tostring())
+                    nrows += len(cands)
+            crc = self.tail_crc(f, offset)
+        meta = {'size': st.st_size, 'mtime': st.st_mtime,
+                'offset': offset, 'nrows': nrows, 'crc': crc,
+                'dtype': self.layout()}
+        with open(metaname, 'w') as m:
+            json.dump(meta, m)
+        return self.map_sidecar(binname, nrows)
+
+class CandidateTail(object):
+    # Follows a candidate file that is still being written, returning only
+    # the complete lines appended since the previous call
+    def __init__(self, filename, dtype=cand_dtype, zero_based=False):
+        self.filename = filename
+        self.offset   = 0
+        self.restarted = False
+        self.loader   = CandidateLoader()
+        self.loader.dtype = dtype
+        self.loader.zero_based = zero_based
+
+    def read_new(self):
+        self.restarted = os.path.getsize(self.filename) < self.offset
+        if self.restarted:
+            # The file was truncated or replaced; start again
+            self.offset = 0
+        chunks = []
+        with open(self.filename, 'rb') as f:
+            for cands, self.offset in self.loader.iter_chunks(f, self.offset):
+                chunks.append(cands)
+        if not chunks:
+            return np.empty(0, dtype=self.loader.dtype)
+        return np.concatenate(chunks)
+
+def load_candidates(filename, use_cache=True, nbeams=32, fields=None):
+    # With fields, only those columns are kept, in compact formats and with
+    # 0-based beam numbers. Binary (.hcb) files are memory-mapped as they
+    # are, with no sidecar.
+    from heimdall_binary import is_binary, load_binary
+    if is_binary(filename):
+        return load_binary(filename, nbeams, fields)
+    loader = CandidateLoader()
+    loader.use_cache = use_cache
+    if fields is None:
+        loader.dtype = make_cand_dtype(nbeams)
+    else:
+        loader.dtype = make_compact_dtype(fields, nbeams)
+        loader.zero_based = True
+    return loader.load(filename)
+
+class CandidateIndex(object):
+    # Time-ordered index over a candidate table for window queries. Rows are
+    # taken in time order in blocks of block_size, and each block keeps its
+    # time span and DM and S/N bounds. A query finds the blocks overlapping
+    # its time range by binary search, skips those whose DM or S/N bounds
+    # miss the window and filters the rest exactly, so it reads
+    # O(log n + matches) rows. Saved beside the candidate file and reused
+    # until the file changes.
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+        self.nrows      = 0
+        self.order      = None # row numbers in time order; None if sorted
+        self.summaries  = {}
+
+    def index_names(self, filename):
+        return filename + '.idx.npz', filename + '.idx.npy'
+
+    def rows(self, start, stop):
+        # Table rows at time-ordered positions [start, stop)
+        if self.order is None:
+            return slice(start, stop)
+        return self.order[start:stop]
+
+    def build(self, cands, chunk=1<<22):
+        n = self.nrows = len(cands)
+        time = cands['time']
+        in_order = all(np.all(time[i+1:j+1] >= time[i:j])
+                       for i, j in [(i, min(i + chunk, n - 1))
+                                    for i in range(0, max(n - 1, 0), chunk)])
+        self.order = None if in_order else \
+            np.argsort(time, kind='mergesort').astype(np.int64)
+        chunk = max(chunk - chunk % self.block_size, self.block_size)
+        parts = dict((name, []) for name in
+                     ('t_min', 't_max', 'dm_min', 'dm_max',
+                      'snr_min', 'snr_max'))
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            rows = self.rows(start, stop)
+            starts = np.arange(0, stop - start, self.block_size)
+            for field, key in (('time', 't'), ('dm', 'dm'), ('snr', 'snr')):
+                vals = cands[field][rows]
+                parts[key + '_min'].append(np.minimum.reduceat(vals, starts))
+                parts[key + '_max'].append(np.maximum.reduceat(vals, starts))
+        self.summaries = dict((name, np.concatenate(p) if p else
+                               np.zeros(0, dtype=np.float32))
+                              for name, p in parts.items())
+        return self
+
+    def query(self, cands, t0=-np.inf, t1=np.inf, dm0=-np.inf, dm1=np.inf,
+              snr0=-np.inf, snr1=np.inf):
+        # Candidates with t0 <= time <= t1, dm0 <= dm <= dm1 and
+        # snr0 <= snr <= snr1, in time order
+        s = self.summaries
+        b0 = np.searchsorted(s['t_max'], t0, 'left')
+        b1 = np.searchsorted(s['t_min'], t1, 'right')
+        blocks = np.arange(b0, max(b0, b1))
+        blocks = blocks[(s['dm_max'][blocks] >= dm0) &
+                        (s['dm_min'][blocks] <= dm1) &
+                        (s['snr_max'][blocks] >= snr0) &
+                        (s['snr_min'][blocks] <= snr1)]
+        positions = (blocks[:,None] * self.block_size +
+                     np.arange(self.block_size)).ravel()
+        positions = positions[positions < self.nrows]
+        rows = positions if self.order is None else self.order[positions]
+        found = cands[rows]
+        keep = ((found['time'] >= t0) & (found['time'] <= t1) &
+                (found['dm'] >= dm0) & (found['dm'] <= dm1) &
+                (found['snr'] >= snr0) & (found['snr'] <= snr1))
+        return found[keep]
+
+    def source_key(self, filename):
+        st = os.stat(filename)
+        return '%i %r %i %i' % (st.st_size, st.st_mtime, self.nrows,
+                                self.block_size)
+
+    def save(self, filename):
+        npzname, npyname = self.index_names(filename)
+        if self.order is not None:
+            np.save(npyname, self.order)
+        elif os.path.exists(npyname):
+            os.remove(npyname)
+        np.savez(npzname, key=np.array(self.source_key(filename)),
+                 **self.summaries)
+
+    def load(self, filename, nrows):
+        # True if a saved index for the file as it is now was found
+        npzname, npyname = self.index_names(filename)
+        self.nrows = nrows
+        try:
+            with np.load(npzname) as saved:
+                if str(saved['key']) != self.source_key(filename):
+                    return False
+                self.summaries = dict((name, saved[name])
+                                      for name in saved.files
+                                      if name != 'key')
+            self.order = np.load(npyname, mmap_mode='r') \
+                if os.path.exists(npyname) else None
+        except (IOError, OSError, KeyError, ValueError):
+            return False
+        return True
+
+def load_index(filename, cands, block_size=4096):
+    # The saved index for filename's candidates, or a new one
+    index = CandidateIndex(block_size)
+    if not index.load(filename, len(cands)):
+        index.build(cands)
+        try:
+            index.save(filename)
+        except (IOError, OSError):
+            # e.g. a read-only data directory; use it unsaved
+            pass
+    return index
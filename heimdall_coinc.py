@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+# Name: Heimdall coincidencer
+#
+# Description: Recomputes the beam_mask and nbeams columns of Heimdall
+# candidates by matching them across beams, including beams searched by
+# separate Heimdall instances or at other stations and written to separate
+# files. Two candidates coincide if their times differ by at most time_tol
+# and their log10(DM + 1) by at most dm_tol. Every candidate gets the mask
+# of the beams with a candidate coinciding with it (its own beam included),
+# ready for Classifier.is_coinc_rfi.
+#
+# The streams are merged and sorted once by (DM cell, time), where the DM
+# cells are dm_tol/dm_subcells wide. The candidates coinciding with any
+# candidate in a given DM cell then form one contiguous run of that order,
+# found by binary search, and the OR of the beam bits over each run comes
+# from a sparse table of packed masks, so all beams are handled at once.
+# That is O(N log N) with no pairwise comparisons. The DM tolerance is
+# applied on the cell grid, so matches reach out to at most
+# dm_tol * (1 + 1/dm_subcells).
+
+import numpy as np
+from heimdall_cands import popcount
+
+class CoincidenceEngine(object):
+    def __init__(self, time_tol=0.01, dm_tol=0.05, nbeams=13):
+        self.time_tol    = time_tol # [s]
+        self.dm_tol      = dm_tol   # in log10(DM + 1)
+        self.dm_subcells = 2
+        self.nbeams      = nbeams
+        self.chunk       = 1<<22
+        self.streams     = []
+
+    def add(self, cands, beam=None, beam_offset=0):
+        # Adds a candidate stream and returns its number. Its beams are
+        # taken from the (1-based) beam column plus beam_offset, or are all
+        # the given 0-based beam.
+        if beam is None:
+            beams = cands['beam'].astype(np.int32) - 1 + beam_offset
+        else:
+            beams = np.empty(len(cands), dtype=np.int32)
+            beams.fill(beam)
+        if len(beams) and (beams.min() < 0 or beams.max() >= self.nbeams):
+            raise ValueError("Beam numbers must lie in 1..%i" % self.nbeams)
+        self.streams.append((cands['time'], cands['dm'], beams))
+        return len(self.streams) - 1
+
+    def sort_keys(self):
+        # Merged (cell, time) sort keys as one float64 per candidate, with
+        # cells spaced further apart than any time window can reach
+        time = np.concatenate([s[0] for s in self.streams]).astype(np.float64)
+        dm = np.concatenate([s[1] for s in self.streams]).astype(np.float64)
+        width = self.dm_tol / self.dm_subcells
+        cell = np.floor(np.log10(np.maximum(dm, 0.0) + 1.0) / width)
+        time -= time.min() if len(time) else 0.0
+        span = (time.max() if len(time) else 0.0) + 2*self.time_tol + 1.0
+        return cell, time, span
+
+    def run(self, mask_dtype=np.uint32):
+        # Returns (beam_masks, nbeams) for every stream, in the order added.
+        # mask_dtype is the beam_mask field format, e.g. 'u4', 'u8' or
+        # ('u8', (nwords,)) as from heimdall_cands.make_cand_dtype.
+        mask_dtype = np.dtype(mask_dtype)
+        word = mask_dtype.base
+        nwords = int(np.prod(mask_dtype.shape))
+        if self.nbeams > 8 * word.itemsize * nwords:
+            raise ValueError("%i beams don't fit in %s masks"
+                             % (self.nbeams, mask_dtype))
+        beams = np.concatenate([s[2] for s in self.streams])
+        n = len(beams)
+        cell, time, span = self.sort_keys()
+        keys = cell * span + time
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        cell = cell[order]
+        time = time[order]
+        # Each candidate's own beam bit, in sorted order
+        bits = np.zeros((n, nwords), dtype=word)
+        sorted_beams = beams[order]
+        bits[np.arange(n), sorted_beams // (8 * word.itemsize)] = \
+            np.left_shift(word.type(1), (sorted_beams % (8 * word.itemsize))
+                          .astype(word))
+        del sorted_beams
+        masks = np.zeros((n, nwords), dtype=word)
+        k = self.dm_subcells
+        for offset in range(-k, k + 1):
+            # Runs of coinciding candidates in the cell offset cells away,
+            # for the candidates in sorted order
+            lo = np.empty(n, dtype=np.intp)
+            hi = np.empty(n, dtype=np.intp)
+            for i in range(0, n, self.chunk):
+                q = (cell[i:i+self.chunk] + offset) * span + \
+                    time[i:i+self.chunk]
+                lo[i:i+self.chunk] = np.searchsorted(keys, q - self.time_tol,
+                                                     'left')
+                hi[i:i+self.chunk] = np.searchsorted(keys, q + self.time_tol,
+                                                     'right')
+            self.or_runs(bits, lo, hi, masks)
+        unsorted = np.empty_like(masks)
+        unsorted[order] = masks
+        counts = popcount(unsorted)
+        results, start = [], 0
+        for s in self.streams:
+            stop = start + len(s[2])
+            m = unsorted[start:stop]
+            results.append((m[:,0] if mask_dtype.shape == () else m,
+                            counts[start:stop]))
+            start = stop
+        return results
+
+    def or_runs(self, bits, lo, hi, out):
+        # out[i] |= bits[lo[i]] | ... | bits[hi[i]-1] for every i, using a
+        # sparse table: at level j, table[p] is the OR of bits[p:p+2**j], and
+        # a run of length L is covered by two overlapping entries of level
+        # floor(log2(L))
+        length = hi - lo
+        nonempty = length > 0
+        level = np.zeros(len(length), dtype=np.intp)
+        level[nonempty] = np.floor(np.log2(length[nonempty])).astype(np.intp)
+        level[~nonempty] = -1
+        table = bits
+        for j in range(level.max() + 1 if len(level) else 0):
+            if j > 0:
+                half = 1 << (j - 1)
+                table = table[:-half] | table[half:]
+            q = np.flatnonzero(level == j)
+            if len(q):
+                out[q] |= table[lo[q]] | table[hi[q] - (1 << j)]
+
+def recompute_beam_masks(streams, time_tol=0.01, dm_tol=0.05, nbeams=13,
+                         beam_base=1):
+    # Overwrites beam_mask and nbeams (if kept) of each candidate table in
+    # streams with the cross-stream coincidences. beam_base is the number
+    # of the first beam in the tables, 0 for compact loads.
+    engine = CoincidenceEngine(time_tol, dm_tol, nbeams)
+    for cands in streams:
+        engine.add(cands, beam_offset=1 - beam_base)
+    if not engine.streams:
+        return
+    mask_dtype = streams[0].dtype.fields['beam_mask'][0]
+    for cands, (masks, counts) in zip(streams, engine.run(mask_dtype)):
+        cands['beam_mask'] = masks
+        if 'nbeams' in cands.dtype.names:
+            cands['nbeams'] = counts
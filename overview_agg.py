@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+# Name: Heimdall Overview Agg renderer
+#
+# Description: Draws the four-panel overview of superb_overview_plotter.py
+# in-process with matplotlib's Agg canvas, so no gnuplot process or X11
+# terminal is needed. The layout, palettes and log axes follow the gnuplot
+# panels, and the panel objects (TimeDMPlot etc.) supply their settings.
+# Output goes straight to overview.png, overview.pdf or overview.ps (or the
+# -o name).
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import (LinearSegmentedColormap, ListedColormap,
+                               BoundaryNorm, LogNorm)
+from matplotlib.ticker import MultipleLocator, NullFormatter
+
+# set palette defined ( 0 'green', 1 'cyan', 2 'magenta', 3 'orange' ) with
+# maxcolors 13 over cbrange [-0.5:12.5], i.e. one colour per boxcar filter
+palette = ListedColormap(
+    LinearSegmentedColormap.from_list(
+        'overview', ['#00ff00', '#00ffff', '#ff00ff', '#ffa500'])
+    (np.linspace(0, 1, 13)))
+filter_norm = BoundaryNorm(np.arange(-0.5, 13.5), palette.N)
+
+# gnuplot's default linetype colours, used for the per-beam histograms
+line_colors = ['#9400d3', '#009e73', '#56b4e9', '#e69f00',
+               '#f0e442', '#0072b2', '#e51e10', '#000000']
+
+class AggRenderer(object):
+    def __init__(self, args, panels, timer):
+        self.args   = args
+        self.panels = panels
+        self.timer  = timer
+        self.size   = (12.8, 9.6) # inches, as the 1280x960 gnuplot png
+        self.dpi    = 100
+        # Room kept around the gnuplot screen layout for tick labels
+        self.pad    = (0.05, 0.04, 0.04, 0.05) # left, bottom, right, top
+
+    def output_name(self):
+        if self.args.g in ("png", "pdf", "ps"):
+            return "%s.%s" % (self.args.o, self.args.g)
+        return "%s.png" % self.args.o
+
+    def screen(self, fig, left, bottom, right, top):
+        # Axes at gnuplot 'set [lbrt]margin at screen' positions
+        pl, pb, pr, pt = self.pad
+        w, h = 1.0 - pl - pr, 1.0 - pb - pt
+        return fig.add_axes([pl + left*w, pb + bottom*h,
+                             (right - left)*w, (top - bottom)*h])
+
+    def log_axes(self, ax, xlim, ylim, top=False, right=False):
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlim(*xlim)
+        ax.set_ylim(*ylim)
+        ax.tick_params(which='both', direction='in', top=True, right=True,
+                       labeltop=top, labelbottom=not top,
+                       labelright=right, labelleft=not right)
+        if top:
+            ax.xaxis.set_label_position('top')
+        if right:
+            ax.yaxis.set_label_position('right')
+
+    def render(self, categories, dm_hists, snr_hists):
+        stage = self.timer.stage
+        fig = Figure(figsize=self.size)
+        FigureCanvasAgg(fig)
+        stage('render_timedm', self.plot_timedm,
+              self.screen(fig, 0.0, 0.0, 1.0, 0.6), categories)
+        stage('render_dmhist', self.plot_dmhist,
+              self.screen(fig, 0.0, 0.65, 0.28, 1.0), dm_hists)
+        stage('render_nsnr', self.plot_nsnr,
+              self.screen(fig, 0.28, 0.65, 0.56, 1.0), snr_hists)
+        stage('render_dmsnr', self.plot_dmsnr,
+              self.screen(fig, 0.56, 0.65, 0.84, 1.0),
+              self.screen(fig, 0.9, 0.65, 0.925, 1.0), categories)
+        name = self.output_name()
+        print "Writing plots to %s" % name
+        stage('flush', fig.savefig, name, dpi=self.dpi)
+
+    def marker_sizes(self, cands, snr_min):
+        # gnuplot 'ps variable' of min((snr - snr_min)/2 + 0.9, 5)
+        ps = np.clip((cands['snr'] - snr_min)/2.0 + 0.9, 0.1, 5)
+        return (3.0*ps)**2
+
+    def plot_timedm(self, ax, data):
+        p = self.panels["timedm"]
+        if len(data['lowdm']) + len(data['valid']) > p.raster_threshold:
+            t_edges, dm_edges, counts = \
+                p.raster_counts(np.concatenate((data['lowdm'],
+                                                data['valid'])))
+            ax.pcolormesh(t_edges, dm_edges,
+                          np.ma.masked_equal(counts, 0), cmap='Greys',
+                          norm=LogNorm(vmin=1, vmax=max(2, counts.max())))
+            data = p.brightest(data)
+        # Text artists are costly in matplotlib, so beam labels are limited
+        # to the top_n brightest even below the raster threshold
+        labelled = p.brightest(data)
+        for name, filled in (('lowdm', False), ('valid', True)):
+            cands = data[name]
+            if len(cands) == 0:
+                continue
+            colors = palette(filter_norm(cands['filter']))
+            ax.scatter(cands['time'], cands['dm'] + p.dm_base,
+                       s=self.marker_sizes(cands, p.snr_min),
+                       facecolors=colors if filled else 'none',
+                       edgecolors=colors, linewidths=1.0)
+            for t, dm, beam in zip(labelled[name]['time'],
+                                   labelled[name]['dm'],
+                                   labelled[name]['beam']):
+                ax.text(t, dm + p.dm_base, '%d' % (beam+1), fontsize=7,
+                        ha='center', va='center')
+        ax.set_yscale('log')
+        ax.set_ylim(*p.dm_range)
+        if p.time_range is None:
+            ax.xaxis.set_major_locator(MultipleLocator(60))
+            ax.xaxis.set_minor_locator(MultipleLocator(15))
+        else:
+            ax.set_xlim(*p.time_range)
+        ax.tick_params(which='both', direction='in', top=True, right=True)
+        ax.grid(True, axis='y', which='both', color='grey', lw=0.2)
+        ax.set_xlabel("Time [s]")
+        ax.set_ylabel(r"DM + 1 [pc cm$^{-3}$]")
+
+    def plot_dmsnr(self, ax, cax, data):
+        p = self.panels["dmsnr"]
+        valid = data['valid']
+        if len(valid) > 0:
+            ax.scatter(valid['dm'] + p.dm_base, valid['snr'], s=10,
+                       c=valid['filter'], cmap=palette, norm=filter_norm,
+                       linewidths=0)
+        self.log_axes(ax, (1.0, 10000), (6.0, 25), top=True, right=True)
+        ax.yaxis.set_minor_formatter(NullFormatter())
+        ax.grid(True, axis='x', which='both', color='grey', lw=0.2)
+        ax.set_xlabel(r"DM+1 [pc cm$^{-3}$]")
+        ax.set_ylabel("S/N")
+        # Boxcar filter colour key, labelled with the widths in ms
+        filters = np.arange(p.max_filter + 1)
+        cax.imshow(filters[:,None], cmap=palette, norm=filter_norm,
+                   aspect='auto', origin='lower',
+                   extent=(0, 1, -0.5, p.max_filter + 0.5))
+        cax.set_xticks([])
+        cax.yaxis.tick_right()
+        cax.set_yticks(filters)
+        cax.set_yticklabels(['%.4g' % (2000*p.dt * 2**i) for i in filters],
+                            fontsize=8)
+        cax.set_title("Width [ms]", fontsize=9)
+
+    def plot_nsnr(self, ax, snr_hists):
+        for b, snr_hist in enumerate(snr_hists):
+            ax.step(snr_hist['bins'], snr_hist['vals'], where='mid',
+                    color=line_colors[b % len(line_colors)],
+                    lw=1 + (b+1 < 8), label=str(b+1))
+        self.log_axes(ax, (6.0, 25), (0.5, 2000), top=True)
+        ax.xaxis.set_minor_formatter(NullFormatter())
+        ax.set_yticklabels([])
+        ax.grid(True, axis='x', which='both', color='grey', lw=0.2)
+        ax.set_xlabel("S/N")
+
+    def plot_dmhist(self, ax, dm_hists):
+        p = self.panels["dmhist"]
+        for b, dm_hist in enumerate(dm_hists):
+            ax.step(dm_hist['bins'] + p.dm_base, dm_hist['vals'], where='mid',
+                    color=line_colors[b % len(line_colors)],
+                    lw=1 + (b+1 < 8), label=str(b+1))
+        self.log_axes(ax, (1, 10000), (0.5, 2000), top=True)
+        ax.grid(True, axis='x', which='both', color='grey', lw=0.2)
+        ax.legend(loc='upper right', ncol=7, fontsize=6, handlelength=1.5,
+                  columnspacing=0.8, frameon=True)
+        ax.set_xlabel(r"DM+1 [pc cm$^{-3}$]")
+        ax.set_ylabel("Candidate count")
+
+def plot_sweep(filename, params, cuts, counts, category_names):
+    # Heat-maps of the valid, RFI and noise counts from Classifier.sweep
+    # over the two most finely swept cuts, the others at their lowest value;
+    # category_names labels the last axis of counts
+    sizes = [len(c) for c in cuts]
+    ya, xa = sorted(sorted(range(len(cuts)), key=lambda a: -sizes[a])[:2])
+    index = [slice(None) if a in (xa, ya) else 0 for a in range(len(cuts))]
+    grid = counts[tuple(index)]
+    c = dict((name, grid[..., i]) for i, name in enumerate(category_names))
+    panels = (("valid", c['valid']),
+              ("RFI", c['coinc'] + c['fat'] + c['lowdm']),
+              ("noise", c['noise']))
+    fixed = ", ".join(["%s=%.4g" % (params[a], cuts[a][0])
+                       for a in range(len(cuts)) if a not in (xa, ya)])
+    fig = Figure(figsize=(5*len(panels), 4.5))
+    FigureCanvasAgg(fig)
+    for i, (title, z) in enumerate(panels):
+        ax = fig.add_subplot(1, len(panels), i + 1)
+        im = ax.imshow(z, origin='lower', aspect='auto',
+                       interpolation='nearest', cmap='viridis')
+        ax.set_xticks(range(sizes[xa]))
+        ax.set_xticklabels(['%.4g' % v for v in cuts[xa]])
+        ax.set_yticks(range(sizes[ya]))
+        ax.set_yticklabels(['%.4g' % v for v in cuts[ya]])
+        ax.set_xlabel(params[xa])
+        ax.set_ylabel(params[ya])
+        ax.set_title(title)
+        if z.size <= 400:
+            for (y, x), n in np.ndenumerate(z):
+                ax.text(x, y, '%i' % n, ha='center', va='center',
+                        fontsize=7, color='white')
+        fig.colorbar(im, ax=ax)
+    if fixed:
+        fig.suptitle(fixed, fontsize=9)
+    fig.savefig(filename)
+
+def images_to_pdf(filenames, output, dpi=100):
+    # Joins image files (e.g. the pages of a paginated overview) into one
+    # PDF, a page each
+    from matplotlib.image import imread
+    from matplotlib.backends.backend_pdf import PdfPages
+    pdf = PdfPages(output)
+    try:
+        for filename in filenames:
+            image = imread(filename)
+            fig = Figure(figsize=(image.shape[1] / float(dpi),
+                                  image.shape[0] / float(dpi)))
+            FigureCanvasAgg(fig)
+            fig.figimage(image)
+            pdf.savefig(fig, dpi=dpi)
+    finally:
+        pdf.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+# Name: Overview result cache
+#
+# Description: Keeps the category counts, plotted candidates and per-beam DM
+# and S/N histograms of earlier overviews, so re-rendering a file (e.g. to
+# another device, or after a styling change) goes straight to the plots.
+# Each entry is an uncompressed .npz in the cache directory named by a hash
+# of the candidate files' identities (path, size, mtime) and of every
+# setting that changes the results. A hit refreshes the entry's mtime and
+# the least recently used entries are removed once the directory grows past
+# max_bytes, so it can be kept on a shared disk. The plotter only uses it when
+# asked to (-result_cache), as the plotted candidates can make entries large.
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+default_dir = os.path.join(os.path.expanduser('~'), '.cache',
+                           'superb_overview')
+
+# Changed whenever the cached results change form
+version = 1
+
+def file_identity(filename):
+    st = os.stat(filename)
+    return [os.path.realpath(filename), st.st_size, st.st_mtime, st.st_ino]
+
+class ResultCache(object):
+    def __init__(self, directory=default_dir, max_bytes=512<<20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, filenames, settings):
+        ident = {'version': version, 'settings': settings,
+                 'files': [file_identity(f) for f in filenames]}
+        return hashlib.sha1(json.dumps(ident, sort_keys=True)).hexdigest()
+
+    def entry_name(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        # (counts, categories, dm_hists, snr_hists) as stored, or None
+        name = self.entry_name(key)
+        try:
+            with np.load(name) as entry:
+                counts = json.loads(str(entry['counts']))
+                categories = dict((n[len('category_'):], entry[n])
+                                  for n in entry.files
+                                  if n.startswith('category_'))
+                nbeams = int(entry['nbeams'])
+                dm_hists = [entry['dm_hist_%i' % b].view(np.recarray)
+                            for b in range(nbeams)]
+                snr_hists = [entry['snr_hist_%i' % b].view(np.recarray)
+                             for b in range(nbeams)]
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        try:
+            # Mark it as recently used
+            os.utime(name, None)
+        except OSError:
+            pass
+        return counts, categories, dm_hists, snr_hists
+
+    def put(self, key, counts, categories, dm_hists, snr_hists):
+        # Stores the results; failures (e.g. a full or read-only disk) only
+        # mean the next run recomputes them
+        arrays = {'counts': np.array(json.dumps(counts)),
+                  'nbeams': np.array(len(dm_hists))}
+        for name, cands in categories.items():
+            arrays['category_' + name] = np.asarray(cands)
+        for b, (dm_hist, snr_hist) in enumerate(zip(dm_hists, snr_hists)):
+            arrays['dm_hist_%i' % b] = np.asarray(dm_hist)
+            arrays['snr_hist_%i' % b] = np.asarray(snr_hist)
+        name = self.entry_name(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written under a temporary name so that readers (other batch
+            # workers, other hosts) never see part of an entry
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            # mkstemp makes it private; let others sharing the cache read it
+            os.chmod(tmp, 0644)
+            os.rename(tmp, name)
+        except (IOError, OSError) as e:
+            print "Could not cache the results in %s (%s)" % (self.directory, e)
+            return
+        self.evict(keep=name)
+
+    def evict(self, keep=None):
+        # Removes the least recently used entries until the cache fits
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another process
+                pass
+            total -= size
@@ -10,87 +10,40 @@ parser = argparse.ArgumentParser()
 #parser.add_argument('-p2', type=float, dest='p2', help='set the lowest period (default: 10.0 seconds)', default=10.0)
 #parser.add_argument('-maxdiff', type=float, dest='maxdiff', help='maximum time difference to use (default: 3600.0 seconds)', default=3600.0)
 parser.add_argument('-id', dest='id', help='label plot with FRB idents (default: false)', action="store_true",default=False)
+parser.add_argument('-density', dest='density', help='show the Aitoff plot as FRB counts in equal-area sky pixels (default: false)', action="store_true",default=False)
+parser.add_argument('-pixels', type=int, dest='pixels', help='latitude bands of the density pixels, each cut into twice as many in longitude (default: 18)', default=18)
+parser.add_argument('-layers', dest='layers', help='with -density, also map each telescope separately (default: false)', action="store_true",default=False)
+parser.add_argument('-max_labels', type=int, dest='max_labels', help='most FRB idents labelled on the density plot, one per pixel (default: 20)', default=20)
+parser.add_argument('-telescopes', dest='telescopes', nargs='+', help='telescopes shown in the alt-az plot, or all (default: parkes)', default=['parkes'])
 parser.add_argument('-update', dest='update', help='update to current FRBCAT sources (default: false)', action="store_true",default=False)
+parser.add_argument('-catalogue', dest='catalogue', help='local copy of the FRBCAT CSV (default: frbcat.csv)', default="frbcat.csv")
+parser.add_argument('-url', dest='url', help='where -update fetches FRBCAT from (default: the FRBCAT web site)', default=None)
 parser.add_argument('--version', action='version', version='%(prog)s 0.0.1')
 args = parser.parse_args()
 
-# Get the most up to date information from FRBCAT
-if args.update:
-    import os
-    os.system('wget -O frbcat.csv "http://www.astronomy.swin.edu.au/pulsar/frbcat/table.php?format=text&amp;sep=comma"')
-#wget -O frbcat.csv "http://www.astronomy.swin.edu.au/pulsar/frbcat/table.php?format=text&amp;sep=comma"
-
-# Read the CSV file from FRBCAT
+# Load the FRBCAT catalogue from the local cache, refreshed from FRBCAT only
+# if it has changed there
 import numpy as np
-frbs = np.zeros((100,5), dtype=object)
-i = 0
-import csv, sys
-file = open("frbcat.csv", 'rb')
-try:
-    reader = csv.DictReader(file)
-    for row in reader: 
-        array = row['Name'],row['RAJ'],row['DECJ'],row['UTC'],row['Telescope']
-        frbs[i]=array
-        i = i +1
-finally:
-    file.close()  
-gl = np.zeros(i)
-gb = np.zeros(i)
-ids = frbs[:,0]
-utc = frbs[:,3]
-tel = frbs[:,4]
+from frbcat import load_catalogue, frbcat_url
+cat = load_catalogue(args.catalogue, args.url or frbcat_url, update=args.update)
+nfrbs = len(cat['name'])
+ids = cat['name']
+utc = cat['utc']
+tel = cat['telescope']
 
-# Convert RA & DEC to gl & gb
-import ephem as e
+# Galactic coordinates come precomputed, gl wrapped to [-pi,pi] for the Aitoff plot
 import math as m
 deg2rad=m.pi/180.0
 rad2deg=1.0/deg2rad
-for i in range(0,56):
-    radec = e.Equatorial(frbs[i][1],frbs[i][2], epoch='2000')
-    g = e.Galactic(radec)
-    if (g.lon > m.pi):
-        gl[i] = g.lon - m.pi*2.0
-    else:
-        gl[i] = g.lon
-    gb[i] = g.lat
-    #print('%.2f %.2f' % (g.lon,g.lat))
-    #print('%s %s' % (g.lon,g.lat))
-#    print('%s %s' % (g.lon*rad2deg,g.lat*rad2deg))
+gl, gb = cat['gl'], cat['gb']
 
-az = np.zeros(56)
-alt = np.zeros(56)
-# Convert RA, DEC & UTC to alt & az
-for i in range(0,56):
-    frb = e.FixedBody()
-    frb._ra = frbs[i][1]
-    frb._dec = frbs[i][2]
-    site=e.Observer()
-    if (tel[i]=="parkes"):
-        site.long = '148:15:44.3'
-        site.lat = '-32:59:59.8'
-        site.elevation = 0
-        place = "Parkes Observatory"
-    elif (tel[i]=="GBT"):
-        site.long = '-79:50:23'
-        site.lat = '38:25:59'
-        site.elevation = 0
-        place = "Green Bank Telescope"
-    elif (tel[i]=="arecibo"):
-        site.long = '-66:45:10'
-        site.lat = '18:20:39'
-        site.elevation = 0
-        place = "Arecibo"
-    elif (tel[i]=="UTMOST"):
-        site.long = '149.4241'
-        site.lat = '35.3707'
-        site.elevation = 0
-        place = "Molonglo"
-    site.date = utc[i]
-    frb.compute(site)
-    if (place == "Parkes Observatory"):
-        az[i]=frb.az
-        alt[i]=frb.alt
-#        print ids[i],frb.az,frb.alt
+# Convert RA, DEC & UTC to alt & az at each FRB's telescope
+from frb_sky import altaz, site_arrays, site_key, site_keys, sites
+site_lon, site_lat = site_arrays(tel)
+alt, az = altaz(cat['ra'], cat['dec'], utc, site_lon, site_lat)
+site = site_keys(tel)
+for t in sorted(set(tel[site == ''])):
+    print "Unknown telescope %s, not shown in the alt-az plot" % t
 
 #print gl*rad2deg,gb*rad2deg
 # Plot things
@@ -100,20 +53,67 @@ plt.figure()
 plt.subplot(111, projection="aitoff")
 plt.title("FRB Galactic Coordinate Distribution - Aitoff Projection")
 plt.grid(True)
-plt.plot(gl,gb, 'o')
-# Optional plotting features
-if args.id:
-    for i in range(0,56):
-        plt.text(gl[i],gb[i],ids[i],fontsize=10) # Obviously this can be tweaked
+if args.density:
+    # Counts in equal-area pixels drawn as one mesh, so the cost doesn't
+    # grow with the catalogue; per-telescope counts come from the same pass
+    from frb_sky import pixel_edges, pixel_centres, sky_pixels, sky_density, label_pixels
+    pix = sky_pixels(gl, gb, args.pixels)
+    if args.layers:
+        layer_keys, layer = np.unique(site_keys(tel), return_inverse=True)
+        layer_counts = sky_density(pix, args.pixels, layer, len(layer_keys))
+        counts = layer_counts.sum(axis=0)
+    else:
+        counts = sky_density(pix, args.pixels)[0]
+    lon_edges, lat_edges = pixel_edges(args.pixels)
+    vmax = max(counts.max(), 1)
+    mesh = plt.pcolormesh(lon_edges, lat_edges, np.ma.masked_equal(counts, 0), cmap='viridis', vmin=1, vmax=vmax)
+    plt.colorbar(mesh, orientation='horizontal', pad=0.08, label='FRBs per %.3g sq. deg.' % (4*m.pi/(2*args.pixels**2)*rad2deg**2))
+    if args.id:
+        # One label per pixel, for the busiest pixels only
+        label_pix, first, label_n = label_pixels(pix, args.max_labels)
+        label_gl, label_gb = pixel_centres(label_pix, args.pixels)
+        for x, y, name, k in zip(label_gl, label_gb, ids[first], label_n):
+            plt.text(x, y, name if k == 1 else '%s +%i' % (name, k-1), fontsize=8, ha='center', va='center')
+else:
+    plt.plot(gl,gb, 'o')
+    # Optional plotting features
+    if args.id:
+        for i in range(nfrbs):
+            plt.text(gl[i],gb[i],ids[i],fontsize=10) # Obviously this can be tweaked
 plt.show()
 
+if args.density and args.layers:
+    # One density map per telescope, on the same colour scale
+    ncols = 2 if len(layer_keys) > 1 else 1
+    nrows = (len(layer_keys) + ncols - 1) // ncols
+    plt.figure(figsize=(6*ncols, 3.5*nrows))
+    for i, key in enumerate(layer_keys):
+        plt.subplot(nrows, ncols, i + 1, projection="aitoff")
+        plt.title(sites[key][0] if key else 'Other telescopes', fontsize=10)
+        plt.grid(True)
+        mesh = plt.pcolormesh(lon_edges, lat_edges, np.ma.masked_equal(layer_counts[i], 0), cmap='viridis', vmin=1, vmax=vmax)
+        plt.gca().set_xticklabels([])
+    plt.colorbar(mesh, ax=plt.gcf().axes, shrink=0.6, label='FRBs per pixel')
+    plt.show()
+
 print az*rad2deg,alt*rad2deg
 # Alt-az plot
+if 'all' in args.telescopes:
+    shown = sorted(set(site[site != '']))
+else:
+    shown = [site_key(t) or t for t in args.telescopes]
 plt.clf()
 sp = plt.subplot(111, projection="polar")
-plt.title("Parkes FRB Zen-Az Distribution")
+if len(shown) == 1:
+    plt.title("%s FRB Zen-Az Distribution" % sites.get(shown[0], (shown[0],))[0])
+else:
+    plt.title("FRB Zen-Az Distribution")
 plt.grid(True)
 #plt.plot(az*rad2deg,90.0-alt*rad2deg, 'o')
 sp.set_theta_zero_location("N")
-plt.plot(az,(0.5*m.pi-alt)*rad2deg, 'o')
+for key in shown:
+    here = site == key
+    plt.plot(az[here],(0.5*m.pi-alt[here])*rad2deg, 'o', label=sites.get(key, (key,))[0])
+if len(shown) > 1:
+    plt.legend(loc='upper right', fontsize=8)
 plt.show()
@@ -7,6 +7,10 @@
 #
 # Published (on FRBCAT) FRBs list shown, full list
 # including unpublished FRBs is in .gitignore
+#
+# all_FRBs and all_FRBs.gp are written by frb_overtime.py from the FRB
+# catalogue; "python frb_overtime.py -update -plot" refreshes both and
+# reruns this script
 
 #set term x11
 set term postscript enhanced color solid
@@ -27,16 +31,20 @@ set boxwidth 1.0
 set xtics 1 font ", 10"
 set mytics 5
 
+# Total, y range and plot clause for the telescopes in the table
+load "all_FRBs.gp"
+ymax = max_per_year + 0.5
+
 # Add some updated labels for when this plot was made
-num_frbs=system("awk '{for (i=2; i<=NF; i++) s+=$i}END{print s}' all_FRBs")
-set label sprintf("{/Symbol S} FRBs %s", num_frbs) front at -0.5, 27 font ", 20"
-#set label sprintf("{/Symbol S} FRBs %s", num_frbs) front at -0.5, 13 font ", 20"
+set label sprintf("{/Symbol S} FRBs %i", num_frbs) front at -0.5, 27.0/44.5*ymax font ", 20"
+#set label sprintf("{/Symbol S} FRBs %i", num_frbs) front at -0.5, 13 font ", 20"
 timestamp=system("date -u \"+%Y-%m-%d UTC\"")
-set label timestamp front at -0.5, 25 font ", 10"
-set label "\\\@evanocathain" front at -0.5, 24 font ", 10" textcolor rgb '#1DCAFF'
+set label timestamp front at -0.5, 25.0/44.5*ymax font ", 10"
+set label "\\\@evanocathain" front at -0.5, 24.0/44.5*ymax font ", 10" textcolor rgb '#1DCAFF'
 
 # Do a H1-2018 note
 #set label sprintf("(Jan-Jun)") front at 16.4, -1.4 font ", 10"
 
-set yrange[0:44.5]
-plot "all_FRBs" using 2:xtic(1) title 'Parkes', '' u 3 title 'UTMOST', '' u 4 title 'GBT', '' u 5 title 'Arecibo', '' u 6 title 'ASKAP', '' u 7 title 'CHIME' lt 8, '' u 8 title 'DSA-10' lt 7, '' u 9 title 'WSRT' lt rgb '#7FFFD4'
+set yrange[0:ymax]
+set macros
+@frb_plot
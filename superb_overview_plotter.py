@@ -10,7 +10,34 @@
 #          2012: edited by Emily Petroff
 #          2017: edited by Evan Keane
 
+import os
+import sys
+import time
+import Queue
+import resource
 import numpy as np
+from heimdall_cands import popcount
+try:
+    import Gnuplot, Gnuplot.funcutils
+    Gnuplot.GnuplotOpts.default_term = 'x11' # stops gnuplot-py freaking out if it fails to find Aqua terminal on osx
+    import gnuplot_binary
+except ImportError:
+    # Only the agg backend can run without gnuplot-py
+    Gnuplot = gnuplot_binary = None
+
+# Candidate category codes returned by Classifier.classify, in order of
+# precedence (a candidate takes the first category it matches)
+category_names = ('hidden', 'noise', 'coinc', 'fat', 'lowdm', 'valid')
+HIDDEN, NOISE, COINC, FAT, LOWDM, VALID = range(len(category_names))
+
+def mask_words(mask, masks):
+    # Splits a python integer beam mask into the word layout of a beam_mask
+    # column so the two can be combined with a broadcast &
+    dtype = masks.dtype
+    bits = 8 * dtype.itemsize
+    nwords = int(np.prod(masks.shape[1:]))
+    words = [(mask >> (bits*w)) & ((1<<bits) - 1) for w in range(nwords)]
+    return np.array(words, dtype=dtype).reshape(masks.shape[1:])
 
 class Classifier(object):
     def __init__(self):
@@ -24,14 +51,21 @@ class Classifier(object):
         self.filter_max  = 12
         
     def is_masked(self, beam):
-        return ((1<<beam) & self.beam_mask) == 0
+        # Look the beam up in a per-beam table rather than shifting, which
+        # would overflow for beam numbers past the integer width
+        nbits = max(self.nbeams, self.beam_mask.bit_length())
+        enabled = np.array([(self.beam_mask >> b) & 1 for b in range(nbits)],
+                           dtype=bool)
+        beam = np.asarray(beam)
+        in_range = (beam >= 0) & (beam < nbits)
+        return ~(in_range & enabled[np.clip(beam, 0, nbits-1)])
     
     def is_hidden(self, cand):
+        # masked | (~masked & secondary) reduces to masked | secondary
         return ( (cand['snr'] < self.snr_cut) |
                  (cand['filter'] > self.filter_cut) |
                  self.is_masked(cand['beam']) |
-                 ((self.is_masked(cand['beam']) != True) &
-                  (cand['beam'] != cand['prim_beam'])) )
+                 (cand['beam'] != cand['prim_beam']) )
     
     def is_noise(self, cand):
         return cand['members'] < self.members_cut
@@ -40,26 +74,197 @@ class Classifier(object):
         return cand['filter'] >= self.filter_max
     
     def count_nbeams(self, mask):
-        n = 0
-        for i in range(self.nbeams):
-            n += (mask & (1<<i)) > 0
-        return n
+        return popcount(mask)
             
+    def masked_nbeams(self, cand):
+        # Number of enabled beams each candidate was detected in
+        masks = cand['beam_mask']
+        if masks.dtype.kind == 'i':
+            masks = masks.view('u%i' % masks.dtype.itemsize)
+        return self.count_nbeams(masks & mask_words(self.beam_mask, masks))
+
     def is_coinc_rfi(self, cand):
-        nbeams = self.count_nbeams(cand['beam_mask'] & self.beam_mask)
-        return nbeams > self.nbeams_cut
+        return self.masked_nbeams(cand) > self.nbeams_cut
     
     def is_lowdm_rfi(self, cand):
         return cand['dm'] < self.dm_cut
 
-class TimeDMPlot(object):
+    def classify(self, cands):
+        # Returns one uint8 category code per candidate. Categories are
+        # written in reverse order of precedence so that each test is
+        # evaluated once and no negated masks need to be combined.
+        codes = np.empty(len(cands), dtype=np.uint8)
+        codes.fill(VALID)
+        codes[self.is_lowdm_rfi(cands)] = LOWDM
+        codes[self.is_fat(cands)]       = FAT
+        codes[self.is_coinc_rfi(cands)] = COINC
+        codes[self.is_noise(cands)]     = NOISE
+        codes[self.is_hidden(cands)]    = HIDDEN
+        return codes
+
+    def counts(self, codes):
+        return np.bincount(codes, minlength=len(category_names))
+
+    def sweep(self, cands, snr_cuts, members_cuts, nbeams_cuts, dm_cuts,
+              filter_cuts):
+        # Category counts for every combination of the given cut values, as
+        # an array of shape (len(snr_cuts), len(members_cuts),
+        # len(nbeams_cuts), len(dm_cuts), len(filter_cuts), ncategories),
+        # with each list of cuts sorted. Gives the same counts as classify()
+        # once per combination, but scans the table only once: each
+        # candidate is reduced to the rank of its S/N, members, nbeams, DM
+        # and filter among the cut values, those ranks are histogrammed, and
+        # cumulative sums over the histogram give every combination's counts.
+        columns = (cands['snr'], cands['members'], self.masked_nbeams(cands),
+                   cands['dm'], cands['filter'])
+        cuts = []
+        for values, column in zip((snr_cuts, members_cuts, nbeams_cuts,
+                                   dm_cuts, filter_cuts), columns):
+            values = [-np.inf if v is None else v for v in values]
+            # Compare at the column's precision, as classify() does
+            dtype = column.dtype if column.dtype.kind == 'f' else None
+            cuts.append(np.unique(np.asarray(values, dtype=dtype)))
+        snr, members, nbeams, dm, filter_ = columns
+        # Which side of each cut a candidate falls: hidden if snr < cut or
+        # filter > cut, noise if members < cut, coinc if nbeams > cut and
+        # lowdm if dm < cut
+        ranks = (np.searchsorted(cuts[0], snr, 'right'),
+                 np.searchsorted(cuts[1], members, 'right'),
+                 np.searchsorted(cuts[2], nbeams, 'left'),
+                 np.searchsorted(cuts[3], dm, 'right'),
+                 np.searchsorted(cuts[4], filter_, 'left'),
+                 self.is_fat(cands).astype(np.intp))
+        # Masked and secondary-beam candidates are hidden whatever the cuts
+        keep = ~(self.is_masked(cands['beam']) |
+                 (cands['beam'] != cands['prim_beam']))
+        shape = tuple(len(c) + 1 for c in cuts) + (2,)
+        hist = np.bincount(np.ravel_multi_index([r[keep] for r in ranks],
+                                                shape),
+                           minlength=int(np.prod(shape))).reshape(shape)
+        def above(a, axis):
+            # [..., i, ...] = sum over ranks > i
+            c = np.flip(np.cumsum(np.flip(a, axis), axis), axis)
+            return np.delete(c, 0, axis)
+        def at_or_below(a, axis):
+            # [..., i, ...] = sum over ranks <= i
+            return np.delete(np.cumsum(a, axis), -1, axis)
+        # Shapes (nsnr, nmembers, nbeams, ndm, nfilter) after the sums
+        shown = at_or_below(above(hist, 0), 4)
+        not_noise = above(shown, 1)
+        not_coinc = at_or_below(not_noise, 2)
+        lowdm = at_or_below(not_coinc[..., 0], 3)
+        shown = shown.sum(axis=(1, 2, 3, 5))[:, None, None, None, :]
+        not_noise = not_noise.sum(axis=(2, 3, 5))[:, :, None, None, :]
+        fat = not_coinc[..., 1].sum(axis=3)[:, :, :, None, :]
+        not_fat = not_coinc[..., 0].sum(axis=3)[:, :, :, None, :]
+        not_coinc = not_coinc.sum(axis=(3, 5))[:, :, :, None, :]
+        out_shape = tuple(len(c) for c in cuts)
+        counts = np.empty(out_shape + (len(category_names),), dtype=np.intp)
+        counts[..., HIDDEN] = len(cands) - shown
+        counts[..., NOISE]  = shown - not_noise
+        counts[..., COINC]  = not_noise - not_coinc
+        counts[..., FAT]    = fat
+        counts[..., LOWDM]  = lowdm
+        counts[..., VALID]  = not_fat - lowdm
+        return cuts, counts
+
+    def indices(self, codes, names=category_names):
+        # Index arrays into the candidate table, so consumers can take just
+        # the rows they need rather than copying every category
+        return dict((name, np.flatnonzero(codes == category_names.index(name)))
+                    for name in names)
+
+class GnuplotPanel(object):
+    # A panel of the gnuplot overview. configure() sends the commands that
+    # don't depend on the data; once preconfigure() has stored them in
+    # gnuplot, each plot sends just a short eval instead.
+    macro = None
+
+    def setup(self):
+        self.g.reset()
+        if self.macro is None:
+            self.configure()
+        else:
+            self.g('eval %s' % self.macro)
+
+    def preconfigure(self, name):
+        g, commands = self.g, []
+        self.g = commands.append
+        try:
+            self.configure()
+        finally:
+            self.g = g
+        g('%s = "%s"' % (name, '; '.join(commands).replace('\\', '\\\\')
+                                               .replace('"', '\\"')))
+        self.macro = name
+
+class TimeDMPlot(GnuplotPanel):
     def __init__(self, g):
         self.g = g
         self.dm_base = 1.0
         self.snr_min = 6.0
+        # Above raster_threshold points the plane is drawn as a density
+        # raster with markers and labels for only the top_n brightest
+        self.raster_threshold = 100000
+        self.top_n = 1000
+        self.raster_nx = 400
+        self.raster_ny = 200
+        self.dm_range = (1.0, 10000.0)
+        self.time_range = None # (t0, t1) when zoomed, otherwise autoscaled
+
+    def raster_counts(self, cands):
+        # Candidate counts binned over time and log(DM + dm_base). Returns
+        # the time and DM + dm_base bin edges and the (ny, nx) count image.
+        nx, ny = self.raster_nx, self.raster_ny
+        t = cands['time'].astype(np.float64)
+        t0, t1 = self.time_range or (t.min(), t.max())
+        if t1 <= t0:
+            t1 = t0 + 1.0
+        lo, hi = np.log10(self.dm_range)
+        log_dms = np.log10(cands['dm'].astype(np.float64) + self.dm_base)
+        ix = np.clip(((t - t0) / (t1 - t0) * nx).astype(np.intp), 0, nx-1)
+        iy = np.clip(((log_dms - lo) / (hi - lo) * ny).astype(np.intp),
+                     0, ny-1)
+        counts = np.bincount(iy*nx + ix, minlength=nx*ny).reshape(ny, nx)
+        return (np.linspace(t0, t1, nx+1), np.logspace(lo, hi, ny+1), counts)
+
+    def density_raster(self, cands):
+        # The raster counts as one grey image (darker = denser, white where
+        # empty) behind the brightest markers. gnuplot only writes images as
+        # a bitmap on linear axes, so it goes on y2 set to log10(DM +
+        # dm_base), and its size depends on the grid, not on the candidates.
+        t_edges, dm_edges, counts = self.raster_counts(cands)
+        lo, hi = np.log10(self.dm_range)
+        shade = np.log1p(counts) / np.log1p(max(counts.max(), 1))
+        grey = np.where(counts > 0, 230*(1 - shade), 255).astype(np.uint8)
+        self.g('unset logscale y2')
+        self.g('set y2range[%.9g:%.9g]' % (lo, hi))
+        self.g('unset y2tics')
+        self.g('set ytics mirror')
+        self.g('set grid front')
+        dx = t_edges[1] - t_edges[0]
+        dy = (hi - lo) / self.raster_ny
+        return gnuplot_binary.ImageData(np.dstack((grey, grey, grey)),
+                                        (t_edges[0] + dx/2, lo + dy/2),
+                                        (dx, dy), using="1:2:3",
+                                        axes="x1y2", with_="rgbimage")
+
+    def brightest(self, data, names=('lowdm', 'valid')):
+        # Keeps only the top_n highest-S/N candidates across the categories
+        snrs = np.concatenate([data[name]['snr'] for name in names])
+        if len(snrs) <= self.top_n:
+            return data
+        keep = np.zeros(len(snrs), dtype=bool)
+        keep[np.argpartition(-snrs, self.top_n)[:self.top_n]] = True
+        data = dict(data)
+        start = 0
+        for name in names:
+            n = len(data[name])
+            data[name] = data[name][keep[start:start+n]]
+            start += n
+        return data
         
-    def plot(self, data):
-        self.g.reset()
+    def configure(self):
         self.g('set tmargin at screen 0.6')
         self.g('set bmargin at screen 0.0')
         self.g('set rmargin at screen 1.0')
@@ -67,11 +272,14 @@ class TimeDMPlot(object):
         self.g('set size 1.0,0.6')
         self.g('set origin 0.0,0.0')
         self.g('unset key')
-        self.g('set autoscale x')
+        if self.time_range is None:
+            self.g('set autoscale x')
+        else:
+            self.g('set xrange[%.9g:%.9g]' % self.time_range)
         self.g('set logscale y')
         self.g('set logscale y2')
-        self.g('set yrange[1.0:10000]')
-        self.g('set y2range[1.0:10000]')
+        self.g('set yrange[%g:%g]' % self.dm_range)
+        self.g('set y2range[%g:%g]' % self.dm_range)
         self.g('set cbrange[-0.5:12.5]')
         self.g('set palette positive nops_allcF maxcolors 13 gamma 1.5 color model RGB')
         self.g("set palette defined ( 0 'green', 1 'cyan', 2 'magenta', 3 'orange' )")
@@ -82,49 +290,56 @@ class TimeDMPlot(object):
         self.g('set mytics 10')
         self.g('set y2tics 10 mirror format ""')
         self.g('set my2tics 10')
-	self.g('set xtics 60')
-        self.g('set x2tics 60 mirror format ""')
-        self.g('set mxtics 4')
-        self.g('set mx2tics 4')
+        if self.time_range is None:
+            self.g('set xtics 60')
+            self.g('set x2tics 60 mirror format ""')
+            self.g('set mxtics 4')
+            self.g('set mx2tics 4')
+        else:
+            # A zoomed window may be only seconds long
+            self.g('set xtics autofreq')
+            self.g('set x2tics autofreq mirror format ""')
         self.g('set xlabel "Time [s]"')
         self.g('set ylabel "DM + 1 [pc cm^{-3}]"')
         self.g('set format y "10^{%T}"')
         self.g('min(x,y) = x<=y?x:y')
         self.g('max(x,y) = x>=y?x:y')
 
+    def plot(self, data):
+        self.setup()
         categories = []
 
+        if len(data['lowdm']) + len(data['valid']) > self.raster_threshold:
+            categories.append(
+                self.density_raster(np.concatenate((data['lowdm'],
+                                                    data['valid']))))
+            data = self.brightest(data)
+
         if len(data['lowdm']) > 0:
-            lowdm = Gnuplot.Data(data['lowdm']['snr'],
-                                 data['lowdm']['time'],
-                                 data['lowdm']['filter'],
-                                 data['lowdm']['dm'],
+            lowdm = gnuplot_binary.RecordData(data['lowdm'],
+                                 ('snr', 'time', 'filter', 'dm'),
                                  using="2:($4+%f):(min(($1-%f)/2.0+0.9,5)):3" \
                                      % (self.dm_base,self.snr_min),
                                  with_="p pt 6 lt palette ps variable")
             categories.append(lowdm)
             
-            lowdmlabels = Gnuplot.Data(data['lowdm']['beam'],
-                                       data['lowdm']['time'],
-                                       data['lowdm']['dm'],
+            lowdmlabels = gnuplot_binary.RecordData(data['lowdm'],
+                                       ('beam', 'time', 'dm'),
                                        using='2:($3+%f):(sprintf("%%d",$1+1))' \
                                            % (self.dm_base),
                                        with_='labels center font ",7" offset 0,0.05 textcolor rgbcolor "black"')
             categories.append(lowdmlabels)
 
         if len(data['valid']) > 0:
-            valid = Gnuplot.Data(data['valid']['snr'],
-                                 data['valid']['time'],
-                                 data['valid']['filter'],
-                                 data['valid']['dm'],
+            valid = gnuplot_binary.RecordData(data['valid'],
+                                 ('snr', 'time', 'filter', 'dm'),
                                  using="2:($4+%f):(min(($1-%f)/2.0+0.9,5)):3" \
                                      % (self.dm_base,self.snr_min),
                                  with_="p pt 7 lt palette ps variable")
             categories.append(valid)
             
-            validlabels = Gnuplot.Data(data['valid']['beam'],
-                                       data['valid']['time'],
-                                       data['valid']['dm'],
+            validlabels = gnuplot_binary.RecordData(data['valid'],
+                                       ('beam', 'time', 'dm'),
                                        using='2:($3+%f):(sprintf("%%d",$1+1))' \
                                            % (self.dm_base),
                                        with_='labels center font ",7" offset 0,0.05 textcolor rgbcolor "black"')
@@ -138,15 +353,14 @@ class TimeDMPlot(object):
         """
         self.g.plot(*categories)
 
-class DMSNRPlot(object):
+class DMSNRPlot(GnuplotPanel):
     def __init__(self, g):
         self.g = g
         self.dm_base = 1.0
         self.snr_base = 5.9
         self.max_filter = 12
         self.dt = 64e-6
-    def plot(self, data):
-        self.g.reset()
+    def configure(self):
         # define the plotting region
         self.g('set tmargin at screen 1.0')
         self.g('set bmargin at screen 0.65')
@@ -195,10 +409,12 @@ class DMSNRPlot(object):
 #        self.g('set cblabel "Boxcar width [ms]"')
         self.g('set label "Width [ms]" at screen 0.9,1.025 front')
 
+    def plot(self, data):
+        self.setup()
         categories = []
 
         if len(data['valid']) > 0:
-            valid = Gnuplot.Data(data['valid']['snr'],
+            valid = gnuplot_binary.Data(data['valid']['snr'],
                                  data['valid']['dm'],
                                  data['valid']['filter'],
                                  using="($2+%f):($1):3" \
@@ -208,6 +424,69 @@ class DMSNRPlot(object):
             
         self.g.plot(*categories)
 
+def beam_histogram(beam, x, nbins, edge, block=1<<20):
+    # Histograms x separately for every beam with one bincount over combined
+    # (beam, bin) indices. Beam b has nbins[b] bins and edge(b, k) gives the
+    # k-th bin edge for arrays of beams and bin numbers. Bins include their
+    # left edge and the last bin is closed, exactly as in np.histogram.
+    nbins = np.asarray(nbins, dtype=np.intp)
+    offsets = np.concatenate(([0], np.cumsum(nbins)))
+    counts = np.zeros(offsets[-1], dtype=np.intp)
+    for i in range(0, len(x), block):
+        b = beam[i:i+block]
+        v = x[i:i+block]
+        nb = nbins[b]
+        lo, hi = edge(b, 0), edge(b, nb)
+        keep = (v >= lo) & (v <= hi)
+        b, v, nb, lo, hi = b[keep], v[keep], nb[keep], lo[keep], hi[keep]
+        idx = ((v.astype(np.float64) - lo) * (nb / (hi - lo))).astype(np.intp)
+        idx = np.clip(idx, 0, nb - 1)
+        # The index computation can be off by one within ~1 ULP of an edge
+        idx[v < edge(b, idx)] -= 1
+        idx[(v >= edge(b, idx+1)) & (idx != nb - 1)] += 1
+        counts += np.bincount(offsets[b] + idx, minlength=offsets[-1])
+    return np.split(counts, offsets[1:-1])
+
+class RunningHistograms(object):
+    # Per-beam counts on a fixed fine grid over [lo, hi], so candidates can
+    # be folded in as they arrive. hists() rebins each beam to the divisor
+    # of the fine bin count nearest the sqrt(N) rule used by build().
+    def __init__(self, nbeams, lo, hi, min_bins, fine_bins=5040):
+        self.nbeams    = nbeams
+        self.lo        = lo
+        self.hi        = hi
+        self.min_bins  = min_bins
+        self.fine_bins = fine_bins
+        self.divisors  = np.array([d for d in range(1, fine_bins+1)
+                                   if fine_bins % d == 0])
+        self.counts    = np.zeros((nbeams, fine_bins), dtype=np.intp)
+        self.n         = np.zeros(nbeams, dtype=np.intp)
+
+    def add(self, beam, x, n):
+        keep = (x >= self.lo) & (x <= self.hi)
+        beam, x = beam[keep], x[keep]
+        idx = ((x - self.lo) * (self.fine_bins / (self.hi - self.lo)))
+        idx = np.minimum(idx.astype(np.intp), self.fine_bins - 1)
+        size = self.nbeams * self.fine_bins
+        self.counts += np.bincount(beam*self.fine_bins + idx,
+                                   minlength=size).reshape(self.counts.shape)
+        self.n += n
+
+    def hists(self):
+        hists = []
+        for b in range(self.nbeams):
+            target = max(self.min_bins, 2*int(np.sqrt(self.n[b])))
+            nbins = self.divisors[np.argmin(abs(self.divisors - target))]
+            vals = self.counts[b].reshape(nbins, -1).sum(axis=1)
+            centres = self.lo + (np.arange(nbins)+0.5)*(self.hi-self.lo)/nbins
+            hists.append((centres, vals))
+        return hists
+
+def beam_index(cands, nbeams, keep):
+    keep = keep & (cands['beam'] >= 0) & (cands['beam'] < nbeams)
+    beam = cands['beam'][keep].astype(np.intp)
+    return beam, keep, np.bincount(beam, minlength=nbeams)
+
 class DMHistogram(object):
     def __init__(self, cands=None):
         self.dm_min   = 0.10
@@ -215,6 +494,8 @@ class DMHistogram(object):
         self.dm_max   = 10010.0
         self.min_bins = 30
         self.hist     = None
+        self.hists    = None
+        self.running  = None
         if cands is not None:
             self.build(cands)
             
@@ -233,12 +514,55 @@ class DMHistogram(object):
                                    range=(log_dm_min,log_dm_max))
         self.hist = np.rec.fromrecords(np.column_stack((bins_, vals)),
                                        names=('bins', 'vals'))
+
+    def build_beams(self, cands, nbeams):
+        # Same histograms as build() for every beam, in a single pass
+        import math
+        beam, keep, N = beam_index(cands, nbeams, cands['filter'] <= 10)
+        log_dm_min = math.log10(self.dm_min)
+        log_dm_max = math.log10(self.dm_max)
+        nbins    = np.maximum(self.min_bins, 2*np.sqrt(N).astype(int))
+        log_dms  = np.log10(np.maximum(cands['dm'][keep], self.dm_min))
+        def edge(b, k):
+            # As np.linspace, in the precision np.histogram compares in
+            e = k*((log_dm_max - log_dm_min) / nbins[b]) + log_dm_min
+            e = np.where(k == nbins[b], log_dm_max, e)
+            return e.astype(log_dms.dtype)
+        vals     = beam_histogram(beam, log_dms, nbins, edge)
+        self.hists = []
+        for b in range(nbeams):
+            binwidth = (log_dm_max - log_dm_min) / nbins[b]
+            bins_ = 10**(log_dm_min + (np.arange(nbins[b])+0.5)*binwidth)
+            self.hists.append(
+                np.rec.fromrecords(np.column_stack((bins_, vals[b])),
+                                   names=('bins', 'vals')))
+        return self.hists
+
+    def start_running(self, nbeams):
+        import math
+        self.running = RunningHistograms(nbeams, math.log10(self.dm_min),
+                                         math.log10(self.dm_max),
+                                         self.min_bins)
+
+    def add(self, cands):
+        beam, keep, N = beam_index(cands, self.running.nbeams,
+                                   cands['filter'] <= 10)
+        log_dms = np.log10(np.maximum(cands['dm'][keep], self.dm_min))
+        self.running.add(beam, log_dms, N)
+
+    def running_hists(self):
+        self.hists = [np.rec.fromrecords(np.column_stack((10**bins_, vals)),
+                                         names=('bins', 'vals'))
+                      for bins_, vals in self.running.hists()]
+        return self.hists
 class SNRHistogram(object):
     def __init__(self, cands=None):
         self.snr_min   = 6.0
         self.snr_max   = 100.0
         self.min_bins = 50
         self.hist     = None
+        self.hists    = None
+        self.running  = None
         if cands is not None:
             self.build(cands)
             
@@ -260,16 +584,50 @@ class SNRHistogram(object):
         self.hist = np.rec.fromrecords(np.column_stack((bins_, vals_n)),
                                        names=('bins', 'vals'))
 
+    def build_beams(self, cands, nbeams):
+        # Same histograms as build() for every beam, in a single pass. The
+        # bin centres double as the histogram edges, as in build().
+        beam, keep, N = beam_index(cands, nbeams, cands['filter'] <= 13)
+        nbins    = np.maximum(self.min_bins, 2*np.sqrt(N).astype(int))
+        binwidth = (self.snr_max - self.snr_min) / nbins
+        snrs     = np.maximum(cands['snr'][keep], self.snr_min)
+        def edge(b, k):
+            return (k + 0.5)*binwidth[b] + self.snr_min
+        vals     = beam_histogram(beam, snrs, nbins - 1, edge)
+        self.hists = []
+        for b in range(nbeams):
+            bins_  = self.snr_min + (np.arange(nbins[b])+0.5)*binwidth[b]
+            vals_n = np.append(vals[b], 0)
+            self.hists.append(
+                np.rec.fromrecords(np.column_stack((bins_, vals_n)),
+                                   names=('bins', 'vals')))
+        return self.hists
+
+    def start_running(self, nbeams):
+        self.running = RunningHistograms(nbeams, self.snr_min, self.snr_max,
+                                         self.min_bins)
+
+    def add(self, cands):
+        beam, keep, N = beam_index(cands, self.running.nbeams,
+                                   cands['filter'] <= 13)
+        snrs = np.maximum(cands['snr'][keep], self.snr_min)
+        self.running.add(beam, snrs, N)
+
+    def running_hists(self):
+        self.hists = [np.rec.fromrecords(np.column_stack((bins_, vals)),
+                                         names=('bins', 'vals'))
+                      for bins_, vals in self.running.hists()]
+        return self.hists
 
-class NSNRPlot(object):
+
+class NSNRPlot(GnuplotPanel):
     def __init__(self, g):
         self.g = g
         self.n_base = 1.0
         self.snr_base = 5.9
         self.max_filter = 12
         self.dt = 64e-6
-    def plot(self, data):
-        self.g.reset()
+    def configure(self):
         self.g('set tmargin at screen 1.0')
         self.g('set bmargin at screen 0.65')
         self.g('set rmargin at screen 0.56')
@@ -310,24 +668,26 @@ class NSNRPlot(object):
         self.g('set format x ""')
         self.g('set format x2 "10^{%T}"')
 
+    def plot(self, data):
+        self.setup()
 	beams = []
 	for b,snr_hist in enumerate(data):
-            beams.append( Gnuplot.Data(snr_hist['bins'],
-                                       snr_hist['vals'],
+            beams.append( gnuplot_binary.RecordData(snr_hist,
+                                       ('bins', 'vals'),
+                                       using="1:2",
                                        with_='histeps lw %i lt 1 lc %i' \
                                            % (1+(b+1<8),b+1),
                                        title=str(b+1)) )
         self.g.plot(*beams)
 
-class DMHistPlot(object):
+class DMHistPlot(GnuplotPanel):
     def __init__(self, g):
         self.g = g
         self.dm_base = 1.0
         self.snr_base = 5.9
         self.max_filter = 12
         self.dt = 64e-6
-    def plot(self, data):
-        self.g.reset()
+    def configure(self):
         self.g('set tmargin at screen 1.0')
         self.g('set bmargin at screen 0.65')
         self.g('set rmargin at screen 0.28')
@@ -356,16 +716,18 @@ class DMHistPlot(object):
         #self.g('set key inside top center horizontal samplen 2 maxcols 2')
         self.g('set key box top right horizontal samplen 2')
         self.g('set key spacing 0.9')
-        self.g('set x2label "DM+1 [pc cm^{-3}]')
+        self.g('set x2label "DM+1 [pc cm^{-3}]"')
         self.g('set ylabel "Candidate count"')
         self.g('set format y "10^{%T}"')
         self.g('set format x ""')
         self.g('set format x2 "10^{%T}"')
 
+    def plot(self, data):
+        self.setup()
         beams = []
         for b,dm_hist in enumerate(data):
-            beams.append( Gnuplot.Data(dm_hist['bins'],
-                                       dm_hist['vals'],
+            beams.append( gnuplot_binary.RecordData(dm_hist,
+                                       ('bins', 'vals'),
                                        using="($1+%f):2" \
                                            % (self.dm_base),
                                        with_='histeps lw %i lt 1 lc %i' \
@@ -373,123 +735,895 @@ class DMHistPlot(object):
                                        title=str(b+1)) )
         self.g.plot(*beams)
 
-if __name__ == "__main__":
-    import argparse
-#    import Gnuplot    
-    import Gnuplot, Gnuplot.funcutils
-    Gnuplot.GnuplotOpts.default_term = 'x11' # stops gnuplot-py freaking out if it fails to find Aqua terminal on osx
+# The candidate columns read by the classifier, plots and histograms, all a
+# -compact load keeps
+overview_fields = ('snr', 'time', 'filter', 'dm', 'members', 'beam_mask',
+                   'prim_beam', 'beam')
 
-    parser = argparse.ArgumentParser(description="Generates data for Heimdall overview plots.")
-    parser.add_argument('-f', default="candidates_all.cand")
-    #parser.add_argument('-p', default="2014-10-30-13:29:21")
-    parser.add_argument('-nbeams', type=int, default=13)
-    parser.add_argument('-snr_cut', type=float)
-    parser.add_argument('-beam_mask', type=int, default=(1<<13)-1)
-    parser.add_argument('-nbeams_cut', type=int, default=2)
-    parser.add_argument('-members_cut', type=int, default=3)
-    parser.add_argument('-dm_cut', type=float, default=1.5)
-    parser.add_argument('-filter_cut', type=int, default=99)
-    parser.add_argument('-filter_max', type=int, default=12)
-    parser.add_argument('-min_bins', type=int, default=30)
-    parser.add_argument('-g', default="ps")
-    parser.add_argument('-interactive', action="store_true")
-    args = parser.parse_args()
-    
-    filename = args.f
-    nbeams = args.nbeams
-    interactive = args.interactive
-    plotdevice = args.g
-
-    # Load candidates from all_candidates file
-    all_cands = \
-        np.loadtxt(filename,
-                   dtype={'names': ('snr','samp_idx','time','filter',
-                                    'dm_trial','dm','members','begin','end',
-                                    'nbeams','beam_mask','prim_beam',
-                                    'max_snr','beam'),
-                          'formats': ('f4', 'i4', 'f4', 'i4',
-                                      'i4', 'f4', 'i4', 'i4', 'i4',
-                                      'i4', 'i4', 'i4',
-                                      'f4', 'i4')})
-    # Adjust for 0-based indexing in python
-    all_cands['prim_beam'] -= 1
-    all_cands['beam'] -= 1
-    
-    print "Loaded %i candidates" % len(all_cands)
-  
-    print all_cands['snr'][0]
- 
+def load_fields(args):
+    # Columns to load: all of them as-is, or with -compact just the ones
+    # used, narrowed and with 0-based beams
+    return overview_fields if args.compact else None
+
+def configure_classifier(args):
     classifier = Classifier()
     classifier.nbeams = args.nbeams
     classifier.snr_cut = args.snr_cut
-    classifier.beam_mask = args.beam_mask
+    if args.beam_mask is None:
+        classifier.beam_mask = (1<<args.nbeams) - 1
+    else:
+        classifier.beam_mask = args.beam_mask
     classifier.nbeams_cut = args.nbeams_cut
     classifier.members_cut = args.members_cut
     classifier.dm_cut = args.dm_cut
     classifier.filter_cut = args.filter_cut
     classifier.filter_max = args.filter_max
+    return classifier
+
+def select_categories(classifier, cands, codes):
+    # Only the categories that get plotted are copied out of the table
+    indices = classifier.indices(codes, ("lowdm", "valid"))
+    return dict((name, cands[idx]) for name, idx in indices.items())
+
+def print_counts(counts):
+    print "Classified %i as hidden," % counts["hidden"]
+    print "           %i as noise spikes," % counts["noise"]
+    print "           %i as coincident RFI," % counts["coinc"]
+    print "           %i as fat RFI, and" % counts["fat"]
+    print "           %i as low-DM RFI, and" % counts["lowdm"]
+    print "           %i as valid candidates." % counts["valid"]
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on OS X
+    return rss / (1024.0**2 if sys.platform == 'darwin' else 1024.0)
+
+class StageTimer(object):
+    # Records wall time, CPU time, candidate count and peak memory for each
+    # stage of the pipeline, for a JSON report or a one-line summary
+    def __init__(self):
+        self.stages = []
+        self.info   = {}
+
+    def stage(self, name, func, *args, **kw):
+        # Runs func(*args, **kw) as the named stage and returns its result. The
+        # candidate count is taken from the result if it is an array;
+        # otherwise use count().
+        wall, cpu = time.time(), os.times()
+        result = func(*args, **kw)
+        cpu_end = os.times()
+        record = {'stage': name,
+                  'wall_s': time.time() - wall,
+                  'cpu_s': (cpu_end[0] - cpu[0]) + (cpu_end[1] - cpu[1]),
+                  'peak_rss_mb': peak_rss_mb()}
+        if isinstance(result, np.ndarray):
+            record['ncands'] = len(result)
+        self.stages.append(record)
+        return result
+
+    def count(self, ncands):
+        self.stages[-1]['ncands'] = ncands
+
+    def report(self):
+        report = dict(self.info)
+        report['stages'] = self.stages
+        report['total_wall_s'] = sum(s['wall_s'] for s in self.stages)
+        report['peak_rss_mb'] = peak_rss_mb()
+        return report
+
+    def summary(self):
+        return " ".join(["%s=%.3gs" % (s['stage'], s['wall_s'])
+                         for s in self.stages]) + \
+            " total=%.3gs peak=%.0fMB" % (self.report()['total_wall_s'],
+                                           peak_rss_mb())
+
+    def write(self, filename):
+        import json
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+def make_panels(g, args):
+    panels = {"timedm": TimeDMPlot(g),
+              "dmsnr":  DMSNRPlot(g),
+              "nsnr":   NSNRPlot(g),
+              "dmhist": DMHistPlot(g)}
+    panels["timedm"].raster_threshold = args.raster_threshold
+    panels["timedm"].top_n = args.top_n
+    if args.zoom:
+        timedm = panels["timedm"]
+        timedm.time_range = tuple(args.zoom[:2])
+        if len(args.zoom) == 4:
+            timedm.dm_range = (max(args.zoom[2] + timedm.dm_base, 1e-3),
+                               args.zoom[3] + timedm.dm_base)
+    return panels
+
+class GnuplotRenderer(object):
+    # Draws the overview by driving an external gnuplot process
+    def __init__(self, args, timer):
+        self.args = args
+        self.timer = timer
+        self.g = Gnuplot.Gnuplot(debug=0)
+        self.panels = make_panels(self.g, args)
+
+    def preconfigure(self):
+        # Stores each panel's fixed commands in gnuplot once, for a renderer
+        # that is kept for many overviews
+        for name, panel in self.panels.items():
+            panel.preconfigure('%s_setup' % name)
+
+    def set_output(self):
+        g, plotdevice = self.g, self.args.g
+        if not self.args.interactive:
+            if plotdevice == "ps":
+                g('set terminal postscript enhanced color solid')
+            elif plotdevice == "png":
+                g('set terminal png enhanced font "arial,10" size 1280, 960')
+            else:
+                return
+            name = "%s.%s" % (self.args.o, plotdevice)
+            g('set output "%s"' % name)
+            print "Writing plots to %s" % name
+
+    def alive(self):
+        # gnuplot-py holds gnuplot as a plain pipe, so a gnuplot that has
+        # exited shows up as a broken pipe on the next write
+        try:
+            self.g('')
+        except (IOError, OSError):
+            return False
+        return True
+
+    def sync(self, timeout=300.0, probe=0.25):
+        # Waits until gnuplot has processed everything sent so far, by
+        # having it print to a marker file; raises straight away if gnuplot
+        # has died rather than waiting out the timeout
+        import tempfile
+        fd, marker = tempfile.mkstemp(suffix='.sync')
+        os.close(fd)
+        try:
+            try:
+                self.g('set print "%s"' % marker)
+                self.g('print "done"')
+                self.g('set print')
+            except (IOError, OSError):
+                raise RuntimeError("gnuplot has exited")
+            start = last_probe = time.time()
+            while os.path.getsize(marker) == 0:
+                now = time.time()
+                if now - start >= timeout:
+                    break
+                if now - last_probe >= probe:
+                    if not self.alive():
+                        raise RuntimeError("gnuplot exited before finishing "
+                                           "the plot")
+                    last_probe = now
+                time.sleep(0.005)
+        finally:
+            os.remove(marker)
+            gnuplot_binary.cleanup()
+
+    def render(self, categories, dm_hists, snr_hists):
+        g, stage = self.g, self.timer.stage
+        self.set_output()
+        g('set size 1,1')
+        g('set origin 0,0')
+        g('set multiplot')
+        stage('render_timedm', self.panels["timedm"].plot, categories)
+        stage('render_dmsnr', self.panels["dmsnr"].plot, categories)
+        stage('render_nsnr', self.panels["nsnr"].plot, snr_hists)
+        stage('render_dmhist', self.panels["dmhist"].plot, dm_hists)
+#        g('plot "superb.jpg" binary filetype=jpg with rgbimage')
+        g('unset multiplot')
+        if not self.args.interactive:
+            # Close the output so the file is complete
+            g('set output')
+        stage('flush', self.sync)
+
+def make_renderer(args, timer=None):
+    if timer is None:
+        timer = StageTimer()
+    if args.backend == "agg":
+        from overview_agg import AggRenderer
+        if args.interactive:
+            print "The agg backend has no interactive display; writing a file"
+        return AggRenderer(args, make_panels(None, args), timer)
+    if Gnuplot is None:
+        raise RuntimeError("The gnuplot backend needs gnuplot-py; "
+                           "use -backend agg without it")
+    gnuplot_binary.enabled = not args.textdata
+    return GnuplotRenderer(args, timer)
+
+class OverviewFollower(object):
+    # Keeps running classification counts, plotted candidates and histograms
+    # for a candidate file that Heimdall is still appending to. Each update
+    # only parses and classifies the newly written lines.
+    def __init__(self, filename, classifier, nbeams, fields=None):
+        from heimdall_cands import CandidateTail, make_cand_dtype, \
+            make_compact_dtype
+        if fields is None:
+            self.tail = CandidateTail(filename, make_cand_dtype(nbeams))
+        else:
+            self.tail = CandidateTail(filename,
+                                      make_compact_dtype(fields, nbeams),
+                                      zero_based=True)
+        self.classifier = classifier
+        self.nbeams     = nbeams
+        self.reset()
+
+    def reset(self):
+        nbeams = self.nbeams
+        self.counts     = np.zeros(len(category_names), dtype=np.intp)
+        self.plotted    = {"lowdm": [], "valid": []}
+        self.dm_hist    = DMHistogram()
+        self.snr_hist   = SNRHistogram()
+        self.dm_hist.start_running(nbeams)
+        self.snr_hist.start_running(nbeams)
+
+    def update(self):
+        cands = self.tail.read_new()
+        if self.tail.restarted:
+            self.reset()
+        if len(cands) == 0:
+            return 0
+        if not self.tail.loader.zero_based:
+            adjust_indices(cands)
+        codes = self.classifier.classify(cands)
+        self.counts += self.classifier.counts(codes)
+        for name, sel in select_categories(self.classifier, cands,
+                                           codes).items():
+            self.plotted[name].append(sel)
+        self.dm_hist.add(cands)
+        self.snr_hist.add(cands)
+        return len(cands)
+
+    def categories(self):
+        categories = {}
+        for name, chunks in self.plotted.items():
+            # Merge once so later renders don't repeat the concatenation
+            self.plotted[name] = [np.concatenate(chunks)]
+            categories[name] = self.plotted[name][0]
+        return categories
+
+def adjust_indices(cands):
+    # Adjust for 0-based indexing in python
+    cands['prim_beam'] -= 1
+    cands['beam'] -= 1
+    return cands
+
+def build_histograms(cands, nbeams):
+    return (DMHistogram().build_beams(cands, nbeams),
+            SNRHistogram().build_beams(cands, nbeams))
+
+def recompute_coincidences(args, cands):
+    # Replaces Heimdall's beam masks with coincidences found across this
+    # file and any -coinc_with files (e.g. beams searched separately)
+    from heimdall_cands import load_candidates
+    from heimdall_coinc import recompute_beam_masks
+    others = [load_candidates(f, not args.nocache, args.nbeams,
+                              load_fields(args))
+              for f in args.coinc_with or []]
+    recompute_beam_masks([cands] + others, args.coinc_dt, args.coinc_dm,
+                         args.nbeams, 0 if args.compact else 1)
+
+# Settings besides the candidate files that change the overview results
+result_settings = ('nbeams', 'snr_cut', 'beam_mask', 'nbeams_cut',
+                   'members_cut', 'dm_cut', 'filter_cut', 'filter_max',
+                   'min_bins', 'zoom', 'compact', 'coinc', 'coinc_dt',
+                   'coinc_dm')
+
+def overview_results(args, timer):
+    # Loads and classifies the candidates and builds the histograms;
+    # returns (counts, categories, dm_hists, snr_hists)
+    from heimdall_cands import load_candidates
+    stage = timer.stage
+    nbeams = args.nbeams
+    classifier = configure_classifier(args)
+    # Load candidates from all_candidates file (via a binary sidecar cache)
+    all_cands = stage('load', load_candidates, args.f, not args.nocache,
+                      nbeams, load_fields(args))
+    if args.coinc or args.coinc_with:
+        stage('coinc', recompute_coincidences, args, all_cands)
+        timer.count(len(all_cands))
+    if args.zoom:
+        # Only the candidates in the zoom window, found via the time index
+        from heimdall_cands import load_index
+        index = stage('index', load_index, args.f, all_cands)
+        timer.count(len(all_cands))
+        t0, t1, dm0, dm1 = (list(args.zoom) + [-np.inf, np.inf])[:4]
+        all_cands = stage('query', index.query, all_cands, t0, t1, dm0, dm1)
+    if not args.compact:
+        all_cands = stage('adjust', adjust_indices, all_cands)
+    
+    print "Loaded %i candidates" % len(all_cands)
     
     # Filter candidates based on classifications
     print "Classifying candidates..."
-    categories = {}
-    is_hidden = classifier.is_hidden(all_cands)
-    is_noise  = (is_hidden==False) & classifier.is_noise(all_cands)
-    is_coinc  = (is_hidden==False) & (is_noise ==False) & classifier.is_coinc_rfi(all_cands)
-    is_fat    = (is_hidden==False) & (is_noise ==False) & (is_coinc ==False) & classifier.is_fat(all_cands)
-    is_lowdm  = (is_hidden==False) & (is_noise ==False) & (is_fat   ==False) & (is_coinc ==False) & classifier.is_lowdm_rfi(all_cands)
-    is_valid  = (is_hidden==False) & (is_noise ==False) & (is_fat   ==False) & (is_coinc ==False) & (is_lowdm ==False)
-    categories["hidden"] = all_cands[is_hidden]
-    categories["noise"]  = all_cands[is_noise]
-    categories["coinc"]  = all_cands[is_coinc]
-    categories["fat"]    = all_cands[is_fat]
-    categories["lowdm"]  = all_cands[is_lowdm]
-    categories["valid"]  = all_cands[is_valid]
-    
-    print "Classified %i as hidden," % len(categories["hidden"])
-    print "           %i as noise spikes," % len(categories["noise"])
-    print "           %i as coincident RFI," % len(categories["coinc"])
-    print "           %i as fat RFI, and" % len(categories["fat"])
-    print "           %i as low-DM RFI, and" % len(categories["lowdm"])
-    print "           %i as valid candidates." % len(categories["valid"])
+    codes = stage('classify', classifier.classify, all_cands)
+    counts = dict(zip(category_names, classifier.counts(codes).tolist()))
+    categories = stage('select', select_categories, classifier, all_cands,
+                       codes)
+    timer.count(len(categories['lowdm']) + len(categories['valid']))
     
     print "Building histograms..."
-    dm_hists = []
-    for beam in range(nbeams):
-        cands = all_cands[all_cands['beam'] == beam]
-        dm_hists.append(DMHistogram(cands).hist)
-    
-    snr_hists = []
-    for beam in range(nbeams):
-         cands = all_cands[all_cands['beam'] == beam]
-         snr_hists.append(SNRHistogram(cands).hist)
+    dm_hists, snr_hists = stage('histograms', build_histograms, all_cands,
+                                nbeams)
+    timer.count(len(all_cands))
+    return counts, categories, dm_hists, snr_hists
+
+def make_overview(args, timer=None, renderer=None):
+    # renderer may be kept from an earlier overview, as by -watch
+    if timer is None:
+        timer = StageTimer()
+    timer.info['file'] = args.f
+    if args.zoom:
+        timer.info['zoom'] = args.zoom
+    results = cache = None
+    if args.result_cache is not None:
+        # Earlier results for the same files and settings, if any
+        from overview_cache import ResultCache, default_dir
+        cache = ResultCache(args.result_cache or default_dir,
+                            args.cache_mb << 20)
+        key = cache.key([args.f] + (args.coinc_with or []),
+                        dict((name, getattr(args, name))
+                             for name in result_settings))
+        results = timer.stage('cache_get', cache.get, key)
+    if results is None:
+        results = overview_results(args, timer)
+        if cache is not None:
+            timer.stage('cache_put', cache.put, key, *results)
+    else:
+        print "Using cached results for %s" % args.f
+    counts, categories, dm_hists, snr_hists = results
+    timer.info['counts'] = counts
+    print_counts(counts)
 
     # Generate plots
     print "Generating plots..."
-    g = Gnuplot.Gnuplot(debug=0)
-    if not interactive:
-        if plotdevice == "ps":
-            g('set terminal postscript enhanced color solid')
-            g('set output "overview.ps"')
-            print "Writing plots to overview.ps"
-        elif plotdevice == "png":
-            g('set terminal png enhanced font "arial,10" size 1280, 960')
-            g('set output "overview.png"')
-            print "Writing plots to overview.png"
-    g('set size 1,1')
-    g('set origin 0,0')
-    g('set multiplot')
-    timedm_plot = TimeDMPlot(g)
-    dmsnr_plot  = DMSNRPlot(g)
-    dmhist_plot = DMHistPlot(g)
-    nsnr_plot = NSNRPlot(g)
-    timedm_plot.plot(categories)
-    dmsnr_plot.plot(categories)
-    nsnr_plot.plot(snr_hists)
-    dmhist_plot.plot(dm_hists)
-#    g('plot "superb.jpg" binary filetype=jpg with rgbimage')
-    g('unset multiplot')
-
-    if interactive:
+    if renderer is None:
+        renderer = make_renderer(args, timer)
+    else:
+        renderer.args, renderer.timer = args, timer
+    renderer.render(categories, dm_hists, snr_hists)
+    return renderer
+
+def follow_overview(args):
+    follower = OverviewFollower(args.f, configure_classifier(args),
+                                args.nbeams, load_fields(args))
+    renderer = make_renderer(args)
+    print "Following %s, updating every %g s (Ctrl-C to stop)" \
+        % (args.f, args.cadence)
+    try:
+        while True:
+            nnew = renderer.timer.stage('update', follower.update)
+            renderer.timer.count(nnew)
+            if nnew > 0:
+                print "Read %i new candidates (%i total)" \
+                    % (nnew, follower.counts.sum())
+                renderer.render(follower.categories(),
+                                follower.dm_hist.running_hists(),
+                                follower.snr_hist.running_hists())
+                report_stages(renderer.timer, args)
+            else:
+                del renderer.timer.stages[:]
+            time.sleep(args.cadence)
+    except KeyboardInterrupt:
+        pass
+    print_counts(dict(zip(category_names, follower.counts)))
+    return renderer
+
+def batch_files(args):
+    # Candidate files named by the -batch globs and the -manifest file
+    import glob
+    files = []
+    for pattern in args.batch or []:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print "No files match %s" % pattern
+        files.extend(matches)
+    if args.manifest:
+        with open(args.manifest) as f:
+            files.extend(line.strip() for line in f
+                         if line.strip() and not line.startswith('#'))
+    # A file named twice would be processed twice at once, racing on its
+    # sidecar cache
+    seen = set()
+    return [f for f in files if not (f in seen or seen.add(f))]
+
+def batch_output_name(filename):
+    # Written beside each input, as the files often share a name
+    return os.path.splitext(filename)[0] + "_overview"
+
+def batch_worker_init():
+    # Progress messages from the workers would interleave; the batch
+    # prints its own
+    sys.stdout = open(os.devnull, 'w')
+
+def batch_overview(args):
+    # One file of a batch, run in a worker process; returns its report
+    timer = StageTimer()
+    try:
+        make_overview(args, timer)
+    except Exception as e:
+        timer.info['error'] = "%s: %s" % (type(e).__name__, e)
+    timer.info['file'] = args.f
+    timer.info['output'] = args.o
+    return timer.report()
+
+def print_batch_table(reports, out=sys.stdout):
+    columns = ("ncands",) + category_names
+    out.write("%-40s " % "file" + " ".join(["%9s" % c for c in columns])
+              + " %9s\n" % "wall_s")
+    for report in reports:
+        counts = report.get('counts')
+        if counts is None:
+            out.write("%-40s %s\n" % (report['file'], report.get('error')))
+            continue
+        row = [sum(counts.values())] + [counts[c] for c in category_names]
+        out.write("%-40s " % report['file'] + " ".join(["%9i" % n for n in row])
+                  + " %9.3g\n" % report['total_wall_s'])
+
+def batch_overview_files(args):
+    # Makes an overview of every file in the batch across a pool of worker
+    # processes, then prints and writes a table of the category counts
+    import copy
+    import multiprocessing
+    files = batch_files(args)
+    jobs = []
+    for filename in files:
+        job = copy.copy(args)
+        job.f = filename
+        job.o = batch_output_name(filename)
+        job.interactive = False
+        jobs.append(job)
+    nworkers = min(args.workers or multiprocessing.cpu_count(),
+                   max(1, len(jobs)))
+    print "Processing %i files with %i workers" % (len(jobs), nworkers)
+    pool = multiprocessing.Pool(nworkers, batch_worker_init)
+    reports = []
+    try:
+        for report in pool.imap_unordered(batch_overview, jobs):
+            reports.append(report)
+            print "[%i/%i] %s -> %s" % (len(reports), len(jobs),
+                                        report['file'],
+                                        report.get('error', report['output']))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    order = dict((filename, i) for i, filename in enumerate(files))
+    reports.sort(key=lambda r: order[r['file']])
+    print_batch_table(reports)
+    with open(args.table, 'w') as f:
+        print_batch_table(reports, f)
+    print "Wrote category counts to %s" % args.table
+    if args.report:
+        import json
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=1)
+    return reports
+
+def page_bounds(time, page_length):
+    # Start times of the page_length-long pages spanning the (sorted) times
+    # and the row where each page begins, from one binary search; page i
+    # holds rows bounds[i]:bounds[i+1]
+    if len(time) == 0:
+        return np.zeros(1), np.zeros(1, dtype=np.intp)
+    first = np.floor(time[0] / page_length) * page_length
+    npages = int((time[-1] - first) // page_length) + 1
+    starts = first + page_length * np.arange(npages + 1)
+    bounds = np.searchsorted(time, starts, 'left')
+    bounds[-1] = len(time)
+    return starts, bounds
+
+# The time-sorted candidates of a paginated overview, set before the worker
+# pool forks so that the workers share it instead of being sent pages
+page_cands = None
+# Each worker's renderer, kept for all the pages it draws
+page_renderer = None
+
+# Page file formats each backend can write, and so can be joined
+page_devices = {'gnuplot': ('ps', 'png'), 'agg': ('ps', 'pdf', 'png')}
+
+def check_page_device(args):
+    if args.g not in page_devices[args.backend]:
+        raise ValueError("-page with the %s backend needs -g one of %s, "
+                         "not %s" % (args.backend,
+                                     ", ".join(page_devices[args.backend]),
+                                     args.g))
+
+def render_page(job):
+    # One page of a paginated overview, run in a worker process; returns
+    # the page's output name, counts and stage report
+    global page_renderer
+    args, start, stop, t0, t1 = job
+    timer = StageTimer()
+    cands = page_cands[start:stop]
+    classifier = configure_classifier(args)
+    codes = timer.stage('classify', classifier.classify, cands)
+    counts = dict(zip(category_names, classifier.counts(codes).tolist()))
+    categories = timer.stage('select', select_categories, classifier, cands,
+                             codes)
+    dm_hists, snr_hists = timer.stage('histograms', build_histograms, cands,
+                                      args.nbeams)
+    timer.count(len(cands))
+    if page_renderer is None:
+        page_renderer = make_renderer(args, timer)
+    page_renderer.args, page_renderer.timer = args, timer
+    page_renderer.panels["timedm"].time_range = (t0, t1)
+    page_renderer.render(categories, dm_hists, snr_hists)
+    timer.info['counts'] = counts
+    return "%s.%s" % (args.o, args.g), timer.report()
+
+def stitch_pages(pages, output, device):
+    # Joins the page files into one multi-page file; returns its name, or
+    # None if that couldn't be done
+    import subprocess
+    if device == "png":
+        from overview_agg import images_to_pdf
+        name = output + ".pdf"
+        images_to_pdf(pages, name)
+        return name
+    name = "%s.%s" % (output, device)
+    cmd = ['gs', '-q', '-dBATCH', '-dNOPAUSE', '-dSAFER',
+           '-sDEVICE=%s' % ('ps2write' if device == "ps" else 'pdfwrite'),
+           '-sOutputFile=%s' % name] + pages
+    try:
+        subprocess.check_call(cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print "Could not join the pages with ghostscript (%s)" % e
+        return None
+    return name
+
+def paginated_overview(args, timer=None):
+    # Splits a long observation into -page second pages and draws a full
+    # overview of each, with its own histograms, across a pool of worker
+    # processes, then joins them into one multi-page file
+    global page_cands
+    import copy
+    import multiprocessing
+    from heimdall_cands import load_candidates
+    # Before any work, as a page the backend can't write only shows up once
+    # the pages are joined
+    check_page_device(args)
+    if timer is None:
+        timer = StageTimer()
+    stage = timer.stage
+    timer.info['file'] = args.f
+    cands = stage('load', load_candidates, args.f, not args.nocache,
+                  args.nbeams, load_fields(args))
+    if args.coinc or args.coinc_with:
+        stage('coinc', recompute_coincidences, args, cands)
+        timer.count(len(cands))
+    if not args.compact:
+        cands = stage('adjust', adjust_indices, cands)
+    time_ = cands['time']
+    if not np.all(time_[1:] >= time_[:-1]):
+        cands = stage('sort', np.take, cands,
+                      np.argsort(time_, kind='mergesort'))
+    starts, bounds = page_bounds(cands['time'], args.page)
+    jobs = []
+    for i in np.flatnonzero(np.diff(bounds)):
+        # Empty pages are left out
+        job = copy.copy(args)
+        job.o = "%s_p%03i" % (args.o, len(jobs) + 1)
+        job.interactive = False
+        jobs.append((job, bounds[i], bounds[i+1], starts[i], starts[i+1]))
+    print "Loaded %i candidates, %i pages of %g s with candidates" \
+        % (len(cands), len(jobs), args.page)
+    page_cands = cands
+    nworkers = min(args.workers or multiprocessing.cpu_count(),
+                   max(1, len(jobs)))
+    wall = time.time()
+    pool = multiprocessing.Pool(nworkers, batch_worker_init)
+    try:
+        results = pool.map(render_page, jobs)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        page_cands = None
+    timer.stages.append({'stage': 'pages', 'wall_s': time.time() - wall,
+                         'cpu_s': sum(s['cpu_s'] for n, r in results
+                                      for s in r['stages']),
+                         'peak_rss_mb': peak_rss_mb(),
+                         'ncands': len(cands)})
+    pages = [name for name, report in results]
+    timer.info['pages'] = [report for name, report in results]
+    name = stage('stitch', stitch_pages, pages, args.o, args.g)
+    if name is None:
+        print "Left the pages in %s" % " ".join(pages)
+    else:
+        for page in pages:
+            os.remove(page)
+        print "Wrote %i pages to %s" % (len(pages), name)
+    return timer
+
+class DirectoryWatcher(object):
+    # Finds candidate files in a directory that have stopped changing and
+    # don't have an up-to-date overview beside them yet
+    def __init__(self, directory, pattern="*.cand", output_ext="ps"):
+        self.directory  = directory
+        self.pattern    = pattern
+        self.output_ext = output_ext
+        self.last       = {} # file -> (size, mtime) at the previous scan
+        self.done       = {} # file -> (size, mtime) when it was queued
+
+    def is_current(self, filename, st):
+        output = "%s.%s" % (batch_output_name(filename), self.output_ext)
+        return os.path.exists(output) and os.path.getmtime(output) >= st.st_mtime
+
+    def scan(self):
+        # Files ready to process, oldest first. A file is only ready once
+        # it looks the same on two scans in a row, so one still being
+        # written is left alone.
+        import glob
+        seen, ready = {}, []
+        for filename in glob.glob(os.path.join(self.directory, self.pattern)):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            key = seen[filename] = (st.st_size, st.st_mtime)
+            if self.done.get(filename) == key or self.last.get(filename) != key:
+                continue
+            if self.is_current(filename, st):
+                self.done[filename] = key
+                continue
+            ready.append((st.st_mtime, filename))
+        self.last = seen
+        self.done = dict((f, key) for f, key in self.done.items() if f in seen)
+        return [filename for mtime, filename in sorted(ready)]
+
+    def run(self, queue, interval, stop):
+        # Feeds the queue until stop is set. When the queue is full this
+        # blocks, and later files wait on disk rather than in memory.
+        while not stop.is_set():
+            for filename in self.scan():
+                if queue.full():
+                    print "Queue full (%i files), waiting" % queue.maxsize
+                while not stop.is_set():
+                    try:
+                        queue.put(filename, timeout=interval)
+                        self.done[filename] = self.last[filename]
+                        break
+                    except Queue.Full:
+                        pass
+            stop.wait(interval)
+
+def watch_directory(args):
+    # Runs as a service: makes an overview of every new candidate file in
+    # the -watch directory, one at a time, with a single renderer kept for
+    # all of them so gnuplot is started and the panels set up only once
+    import copy
+    import threading
+    renderer = make_renderer(args)
+    if hasattr(renderer, 'preconfigure'):
+        renderer.preconfigure()
+    watcher = DirectoryWatcher(args.watch, args.pattern, args.g)
+    queue = Queue.Queue(args.queue)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run,
+                              args=(queue, args.cadence, stop))
+    thread.daemon = True
+    thread.start()
+    print "Watching %s for %s, polling every %g s (Ctrl-C to stop)" \
+        % (args.watch, args.pattern, args.cadence)
+    try:
+        while True:
+            try:
+                # Times out now and then so Ctrl-C gets through
+                filename = queue.get(timeout=1.0)
+            except Queue.Empty:
+                continue
+            job = copy.copy(args)
+            job.f = filename
+            job.o = batch_output_name(filename)
+            job.interactive = False
+            timer = StageTimer()
+            try:
+                make_overview(job, timer, renderer)
+                print "%s -> %s (%i queued): %s" % (filename, job.o,
+                                                    queue.qsize(),
+                                                    timer.summary())
+            except Exception as e:
+                print "%s failed: %s: %s" % (filename, type(e).__name__, e)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    thread.join()
+    return renderer
+
+# Classifier cut parameters swept by -sweep, in Classifier.sweep order
+sweep_params = ('snr_cut', 'members_cut', 'nbeams_cut', 'dm_cut',
+                'filter_cut')
+
+def print_sweep_table(cuts, counts, out=sys.stdout):
+    # One row per combination of cuts, with RFI = coinc + fat + lowdm
+    out.write(" ".join(["%11s" % p for p in sweep_params]) + " " +
+              " ".join(["%9s" % c for c in category_names + ("rfi",)]) + "\n")
+    for idx in np.ndindex(*counts.shape[:-1]):
+        row = counts[idx]
+        rfi = row[COINC] + row[FAT] + row[LOWDM]
+        out.write(" ".join(["%11.4g" % cuts[i][j] for i, j in enumerate(idx)])
+                  + " " + " ".join(["%9i" % n for n in row]) + " %9i\n" % rfi)
+
+def sweep_cuts(args, timer=None):
+    # Category counts over a grid of classifier cuts from one load of the
+    # candidates, instead of a full run per combination
+    from heimdall_cands import load_candidates
+    if timer is None:
+        timer = StageTimer()
+    stage = timer.stage
+    classifier = configure_classifier(args)
+    timer.info['file'] = args.f
+    cands = stage('load', load_candidates, args.f, not args.nocache,
+                  args.nbeams, load_fields(args))
+    if args.coinc or args.coinc_with:
+        stage('coinc', recompute_coincidences, args, cands)
+    if not args.compact:
+        cands = stage('adjust', adjust_indices, cands)
+    grid = [getattr(args, p + 's') or [getattr(args, p)]
+            for p in sweep_params]
+    cuts, counts = stage('sweep', classifier.sweep, cands, *grid)
+    timer.count(len(cands))
+    print "Swept %i cut combinations over %i candidates" \
+        % (counts[..., 0].size, len(cands))
+    print_sweep_table(cuts, counts)
+    with open(args.table, 'w') as f:
+        print_sweep_table(cuts, counts, f)
+    print "Wrote sweep counts to %s" % args.table
+    if args.sweep_plot:
+        from overview_agg import plot_sweep
+        stage('render_sweep', plot_sweep, args.sweep_plot, sweep_params,
+              cuts, counts, category_names)
+        print "Wrote sweep heat-map to %s" % args.sweep_plot
+    return timer
+
+def report_stages(timer, args):
+    if args.report:
+        timer.write(args.report)
+    if args.summary:
+        print timer.summary()
+    # Follow mode reports on each update separately
+    del timer.stages[:]
+
+def make_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Generates data for Heimdall overview plots.")
+    parser.add_argument('-f', default="candidates_all.cand")
+    parser.add_argument('-o', default="overview",
+                        help="output file name, without the extension")
+    #parser.add_argument('-p', default="2014-10-30-13:29:21")
+    parser.add_argument('-nbeams', type=int, default=13)
+    parser.add_argument('-snr_cut', type=float)
+    parser.add_argument('-beam_mask', type=lambda x: int(x, 0)) # default: all beams
+    parser.add_argument('-nbeams_cut', type=int, default=2)
+    parser.add_argument('-members_cut', type=int, default=3)
+    parser.add_argument('-dm_cut', type=float, default=1.5)
+    parser.add_argument('-filter_cut', type=int, default=99)
+    parser.add_argument('-filter_max', type=int, default=12)
+    parser.add_argument('-min_bins', type=int, default=30)
+    parser.add_argument('-g', default="ps",
+                        help="output device: ps or png (agg also takes pdf)")
+    parser.add_argument('-backend', choices=("gnuplot", "agg"),
+                        default="gnuplot",
+                        help="render with gnuplot or in-process matplotlib")
+    parser.add_argument('-interactive', action="store_true")
+    parser.add_argument('-nocache', action="store_true",
+                        help="don't use the sidecar caches of parsed "
+                             "candidates")
+    parser.add_argument('-result_cache', metavar="DIR", nargs='?', const='',
+                        help="cache the classification and histogram "
+                             "results, including the plotted candidates, in "
+                             "DIR (default: ~/.cache/superb_overview); off "
+                             "unless given")
+    parser.add_argument('-cache_mb', type=int, default=512,
+                        help="size limit of the result cache [MB]")
+    parser.add_argument('-compact', action="store_true",
+                        help="load only the columns used, in narrow formats")
+    parser.add_argument('-report', metavar="FILE",
+                        help="write per-stage timings and memory as JSON")
+    parser.add_argument('-summary', action="store_true",
+                        help="print a one-line per-stage timing summary")
+    parser.add_argument('-textdata', action="store_true",
+                        help="send plot data to gnuplot as text, not binary")
+    parser.add_argument('-follow', action="store_true",
+                        help="keep re-rendering as candidates are appended; "
+                             "the histograms are rebinned from a fixed fine "
+                             "grid, so their bin edges differ a little from "
+                             "a one-off overview's")
+    parser.add_argument('-cadence', type=float, default=30.0,
+                        help="seconds between -follow updates or -watch "
+                             "scans")
+    parser.add_argument('-raster_threshold', type=int, default=100000,
+                        help="plot a density raster above this many points")
+    parser.add_argument('-top_n', type=int, default=1000,
+                        help="candidates still marked on a density raster")
+    parser.add_argument('-zoom', type=float, nargs='+',
+                        metavar="LIMIT",
+                        help="T0 T1 [DM0 DM1]: plot only the candidates in "
+                             "this time [s] and DM window")
+    parser.add_argument('-coinc', action="store_true",
+                        help="recompute beam masks by matching candidates "
+                             "across beams")
+    parser.add_argument('-coinc_with', nargs='+', metavar="FILE",
+                        help="also match against these candidate files "
+                             "(implies -coinc)")
+    parser.add_argument('-coinc_dt', type=float, default=0.01,
+                        help="coincidence time tolerance [s]")
+    parser.add_argument('-coinc_dm', type=float, default=0.05,
+                        help="coincidence tolerance in log10(DM + 1); it "
+                             "is applied on a grid of half-tolerance cells, "
+                             "so matches reach up to 1.5 times this")
+    parser.add_argument('-batch', nargs='+', metavar="GLOB",
+                        help="make an overview of every matching file")
+    parser.add_argument('-manifest', metavar="FILE",
+                        help="batch over the files listed in FILE")
+    parser.add_argument('-workers', type=int,
+                        help="batch worker processes (default: all cores)")
+    parser.add_argument('-table', default="overview_counts.txt",
+                        help="where -batch and -sweep write their tables")
+    parser.add_argument('-page', type=float, metavar="SECONDS",
+                        help="split the overview into pages this long, "
+                             "drawn in parallel and joined into one file "
+                             "(ps or pdf; with -g png the pages are joined "
+                             "into a PDF as raster images)")
+    parser.add_argument('-watch', metavar="DIR",
+                        help="keep making overviews of new files in DIR")
+    parser.add_argument('-pattern', default="*.cand",
+                        help="candidate files -watch looks for")
+    parser.add_argument('-queue', type=int, default=8,
+                        help="files -watch queues before it stops scanning")
+    parser.add_argument('-sweep', action="store_true",
+                        help="tabulate category counts over a grid of cuts")
+    parser.add_argument('-snr_cuts', type=float, nargs='+')
+    parser.add_argument('-members_cuts', type=int, nargs='+')
+    parser.add_argument('-nbeams_cuts', type=int, nargs='+')
+    parser.add_argument('-dm_cuts', type=float, nargs='+')
+    parser.add_argument('-filter_cuts', type=int, nargs='+')
+    parser.add_argument('-sweep_plot', metavar="FILE",
+                        help="also draw the sweep as a heat-map")
+    return parser
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+    if args.zoom and len(args.zoom) not in (2, 4):
+        parser.error("-zoom takes T0 T1 or T0 T1 DM0 DM1")
+    if args.zoom and args.page:
+        parser.error("-zoom and -page can't be combined")
+    if args.follow and (args.coinc or args.coinc_with or args.zoom):
+        parser.error("-follow can't be combined with -coinc, -coinc_with "
+                     "or -zoom")
+    if args.page:
+        try:
+            check_page_device(args)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    if args.batch or args.manifest:
+        batch_overview_files(args)
+        args.interactive = False
+    elif args.page:
+        report_stages(paginated_overview(args), args)
+        args.interactive = False
+    elif args.watch:
+        renderer = watch_directory(args)
+        args.interactive = False
+    elif args.sweep:
+        report_stages(sweep_cuts(args), args)
+        args.interactive = False
+    elif args.follow:
+        renderer = follow_overview(args)
+    else:
+        renderer = make_overview(args)
+        report_stages(renderer.timer, args)
+
+    if args.interactive:
         raw_input('Please press return to close...\n')
         
     print "Done"